@@ -0,0 +1,260 @@
+import argparse
+import json
+import platform
+import random
+import re
+import sys
+import time
+import tracemalloc
+
+from benchmarks.bit_nfa import ladder_nfa_design
+from the_simplest_computers.codegen import GeneratedDFATable, generated, purge
+from the_simplest_computers.derivatives import DerivativeDesign
+from the_simplest_computers.finite_automata import DFADesign, DFARulebook, FARule, NFASimulation
+from the_simplest_computers.regular_expressions import (Choose, Concatenate, Empty, Literal, Repeat,
+                                                        compile as compile_pattern)
+from the_simplest_computers.search import Searcher
+
+
+def concatenate(patterns):
+    pattern = patterns[0]
+    for next_pattern in patterns[1:]:
+        pattern = Concatenate(pattern, next_pattern)
+    return pattern
+
+
+def cycle_dfa_design(size):
+    # accepts strings with a multiple of size 'a's, ignoring 'b's
+    rules = []
+    for state in range(size):
+        rules.append(FARule(state, 'a', (state + 1) % size))
+        rules.append(FARule(state, 'b', state))
+    return DFADesign(0, [0], DFARulebook(rules))
+
+
+def a_or_aa_star_b(n):
+    pattern = Concatenate(Repeat(Choose(Literal('a'), Concatenate(Literal('a'), Literal('a')))),
+                          Literal('b'))
+    return pattern, '(a|aa)*b', 'a' * n
+
+
+def optional_a_n_a_n(n):
+    pattern = concatenate([Choose(Empty(), Literal('a')) for _ in range(n)]
+                          + [Literal('a') for _ in range(n)])
+    return pattern, 'a?' * n + 'a' * n, 'a' * n
+
+
+def nested_stars(n):
+    pattern = Literal('a')
+    for _ in range(3):
+        pattern = Repeat(pattern)
+    return Concatenate(pattern, Literal('b')), '((a*)*)*b', 'a' * n
+
+
+def warmed(pattern):
+    # Pattern.matches builds its automaton on first use; do that as part of
+    # the compile step so the timed runs only measure matching.
+    pattern.compile().compiled()
+    return pattern
+
+
+def measure(compile, run):
+    tracemalloc.start()
+    started = time.perf_counter()
+    compiled = compile()
+    compile_seconds = time.perf_counter() - started
+    _, compile_peak = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    run(compiled)
+    _, run_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # timed again without tracemalloc, which slows allocation down
+    started = time.perf_counter()
+    result = run(compiled)
+    run_seconds = time.perf_counter() - started
+    return result, compile_seconds, run_seconds, max(compile_peak, run_peak)
+
+
+def record(results, name, params, chars, compile, run):
+    result, compile_seconds, run_seconds, peak_bytes = measure(compile, run)
+    results.append({
+        'name': name,
+        'params': params,
+        'result': result,
+        'chars': chars,
+        'compile_seconds': compile_seconds,
+        'run_seconds': run_seconds,
+        'ns_per_char': run_seconds / chars * 1e9 if chars else None,
+        'chars_per_second': chars / run_seconds if run_seconds else None,
+        'peak_bytes': peak_bytes,
+    })
+    print(f"{name:<28} {json.dumps(params):<36} {run_seconds:>9.4f}s "
+          f"{compile_seconds:>9.4f}s {peak_bytes:>10}", file=sys.stderr)
+
+
+def dfa_benchmarks(results, quick):
+    random.seed(0)
+    for size in [4, 64] if quick else [4, 64, 512]:
+        for length in [100, 1000] if quick else [100, 1000, 10000]:
+            string = ''.join(random.choice('ab') for _ in range(length))
+            design = cycle_dfa_design(size)
+            record(results, 'DFADesign.accepts', {'states': size, 'length': length}, length,
+                   lambda: design, lambda design: design.accepts(string))
+            record(results, 'DFATable.accepts', {'states': size, 'length': length}, length,
+                   design.compile, lambda table: table.accepts(string))
+
+
+def regenerated(design):
+    # skips the fingerprint cache so the compile column includes codegen
+    purge()
+    return generated(design)
+
+
+def codegen_benchmarks(results, quick):
+    # 'switching' changes state on half the characters, the worst case for
+    # generated code; 'steady' mostly stays put, as a lexer DFA does
+    random.seed(0)
+    for size in [4, 64] if quick else [4, 16, 64, 512, 2048]:
+        design = cycle_dfa_design(size)
+        for text, choices in [('switching', 'ab'), ('steady', 'a' + 'b' * 15)]:
+            for length in [1000] if quick else [1000, 100000]:
+                string = ''.join(random.choice(choices) for _ in range(length))
+                params = {'states': size, 'text': text, 'length': length}
+                if length <= 1000:
+                    record(results, 'DFADesign.accepts', params, length,
+                           lambda: design, lambda design: design.accepts(string))
+                record(results, 'DFATable.accepts', params, length,
+                       design.compile, lambda table: table.accepts(string))
+                # generated falls back to a plain DFATable past codegen.MAX_STATES
+                fallback = not isinstance(regenerated(design), GeneratedDFATable)
+                record(results, 'DFATable.accepts (fallback)' if fallback
+                       else 'GeneratedDFATable.accepts', params, length,
+                       lambda: regenerated(design), lambda table: table.accepts(string))
+
+
+def nfa_benchmarks(results, quick):
+    random.seed(0)
+    for size in [16, 64] if quick else [16, 64, 128]:
+        for length in [100] if quick else [100, 1000]:
+            string = ''.join(random.choice('ab') for _ in range(length))
+            design = ladder_nfa_design(size)
+            record(results, 'NFADesign.accepts', {'states': size, 'length': length}, length,
+                   lambda: design, lambda design: design.accepts(string))
+            record(results, 'BitNFADesign.accepts', {'states': size, 'length': length}, length,
+                   design.compile, lambda compiled: compiled.accepts(string))
+
+
+def determinization_benchmarks(results, quick):
+    for size in [6, 8] if quick else [6, 8, 10, 12]:
+        design = ladder_nfa_design(size)
+        record(results, 'NFASimulation.to_dfa_design', {'states': size}, 0,
+               lambda: NFASimulation(design),
+               lambda simulation: len(simulation.to_dfa_design().rulebook.rules))
+
+
+def pathological_benchmarks(results, quick):
+    # re backtracks exponentially on these, so it only runs up to re_limit
+    families = [(a_or_aa_star_b, [10, 20] if quick else [10, 20, 26], 26),
+                (optional_a_n_a_n, [5, 10] if quick else [5, 10, 15, 20], 20),
+                (nested_stars, [8, 10] if quick else [8, 10, 12, 24], 12)]
+    for family, sizes, re_limit in families:
+        for n in sizes:
+            pattern, regex, string = family(n)
+            params = {'family': family.__name__, 'n': n}
+            record(results, 'Pattern.matches', params, len(string),
+                   lambda: warmed(family(n)[0]), lambda pattern: pattern.matches(string))
+            record(results, 'DerivativeDesign.accepts', params, len(string),
+                   lambda: DerivativeDesign(family(n)[0]), lambda design: design.accepts(string))
+            if n <= re_limit:
+                record(results, 're.fullmatch', params, len(string),
+                       lambda: re.compile(regex), lambda compiled: bool(compiled.fullmatch(string)))
+
+
+def sparse_text(length, needle):
+    random.seed(0)
+    words = [''.join(random.choice('abcdefghij ') for _ in range(80)) for _ in range(length // 80)]
+    words[len(words) // 2] = needle
+    return ''.join(words)
+
+
+def unfiltered_searcher(compiled):
+    partition, nfa_design = compiled.partitioned_nfa_design()
+    return Searcher(nfa_design.compile(), partition)
+
+
+def search_benchmarks(results, quick):
+    # one match in a long text: the literal prefilter skips straight to it
+    patterns = [('ERROR [0-9]+', 'ERROR 42'), ('[a-z]+@example\\.com', 'root@example.com')]
+    for source, needle in patterns:
+        for length in [10000, 100000] if quick else [10000, 100000, 1000000]:
+            text = sparse_text(length, needle)
+            params = {'pattern': source, 'length': length}
+            compiled = compile_pattern(source)
+            record(results, 'CompiledPattern.findall', params, length,
+                   lambda: compiled.compiled_searcher(),
+                   lambda searcher: searcher.findall(text))
+            if length <= 100000:
+                record(results, 'Searcher.findall (no prefilter)', params, length,
+                       lambda: unfiltered_searcher(compiled),
+                       lambda searcher: searcher.findall(text))
+            record(results, 're.findall', params, length,
+                   lambda: re.compile(source), lambda compiled: compiled.findall(text))
+
+
+def captures_benchmarks(results, quick):
+    # inputs that make re backtrack exponentially; the PikeVM stays linear
+    families = [('(a|aa)*(b)', 'a', 24), ('((a*)*)*(b)', 'a', 10), ('(x+x+)+(y)', 'x', 18)]
+    for source, character, re_limit in families:
+        for n in [10, 16, 1000] if quick else [10, 16, 24, 1000, 10000]:
+            string = character * n
+            params = {'pattern': source, 'n': n}
+            record(results, 'CompiledPattern.match', params, n,
+                   lambda: compile_pattern(source).compiled_pike_vm(),
+                   lambda pike_vm: pike_vm.match(string))
+            if n <= re_limit:
+                record(results, 're.match', params, n, lambda: re.compile(source),
+                       lambda compiled: compiled.match(string))
+
+
+BENCHMARKS = {
+    'dfa': dfa_benchmarks,
+    'codegen': codegen_benchmarks,
+    'nfa': nfa_benchmarks,
+    'determinization': determinization_benchmarks,
+    'pathological': pathological_benchmarks,
+    'search': search_benchmarks,
+    'captures': captures_benchmarks,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the_simplest_computers automata.')
+    parser.add_argument('--quick', action='store_true', help='smaller workloads')
+    parser.add_argument('--only', choices=sorted(BENCHMARKS), action='append',
+                        help='run only these groups')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    results = []
+    for name in args.only or BENCHMARKS:
+        BENCHMARKS[name](results, args.quick)
+
+    report = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'quick': args.quick,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
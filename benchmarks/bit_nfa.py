@@ -0,0 +1,57 @@
+import random
+import time
+
+from the_simplest_computers.finite_automata import FARule, NFARulebook, NFADesign
+
+
+def ladder_nfa_design(size):
+    # (a|b)*a(a|b){size-2} with a free move every few steps, so the active set
+    # keeps growing towards the whole automaton.
+    rules = [FARule(0, 'a', 0), FARule(0, 'b', 0), FARule(0, 'a', 1)]
+    for state in range(1, size - 1):
+        rules.append(FARule(state, 'a', state + 1))
+        rules.append(FARule(state, 'b', state + 1))
+        if state % 7 == 0:
+            rules.append(FARule(state, None, state + 1))
+    return NFADesign(0, {size - 1}, NFARulebook(rules))
+
+
+def timed(accepts, string, budget=1.0):
+    runs = 0
+    started = time.perf_counter()
+    while True:
+        result = accepts(string)
+        runs += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= budget:
+            return result, elapsed / runs
+
+
+def main():
+    random.seed(0)
+    print(f"{'states':>8} {'chars':>6} {'engine':>8} {'per char':>12} {'speedup':>8}")
+    # The plain rulebook scans every rule for every active state. The ladder's
+    # active set grows by about one state per character, so short strings keep
+    # it runnable at every size.
+    for size, length in [(64, 2000), (1000, 100), (10000, 30)]:
+        nfa_design = ladder_nfa_design(size)
+        string = ''.join(random.choice('ab') for _ in range(length))
+
+        engines = [('set', nfa_design.accepts),
+                   ('indexed', NFADesign(0, nfa_design.accept_states,
+                                         nfa_design.rulebook.indexed()).accepts),
+                   ('bits', nfa_design.compile().accepts)]
+
+        baseline = None
+        results = set()
+        for name, accepts in engines:
+            result, seconds = timed(accepts, string)
+            results.add(result)
+            baseline = baseline or seconds
+            print(f"{size:>8} {length:>6} {name:>8} {seconds / length * 1e6:>10.2f}us "
+                  f"{baseline / seconds:>7.1f}x")
+        assert len(results) == 1
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import os
+import tempfile
+import time
+
+from the_simplest_computers.finite_automata import NFASimulation
+from the_simplest_computers.regular_expressions import Choose, Concatenate, Literal, Repeat
+from the_simplest_computers.serialization import dump, load
+
+
+def pattern_with_tail(length):
+    # (a|b)*a(a|b){length}: determinization produces 2^(length+1) states
+    a_or_b = Choose(Literal('a'), Literal('b'))
+    pattern = Concatenate(Repeat(a_or_b), Literal('a'))
+    for _ in range(length):
+        pattern = Concatenate(pattern, a_or_b)
+    return pattern
+
+
+def best_of(function, runs=5):
+    best = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main():
+    print(f"{'tail':>5} {'states':>7} {'bytes':>8} {'compile':>10} {'load':>10} {'speedup':>8}")
+    for length in [4, 7, 9]:
+        pattern = pattern_with_tail(length)
+
+        def recompile():
+            return NFASimulation(pattern.to_nfa_design()).to_dfa_design().compile()
+
+        table, compile_seconds = best_of(recompile, runs=1 if length > 7 else 3)
+        with tempfile.NamedTemporaryFile(delete=False) as file:
+            pass
+        try:
+            dump(table, file.name)
+            loaded, load_seconds = best_of(lambda: load(file.name))
+            size = os.path.getsize(file.name)
+        finally:
+            os.unlink(file.name)
+
+        string = 'ab' * 50
+        assert loaded.accepts(string) == table.accepts(string)
+        print(f"{length:>5} {len(table.states):>7} {size:>8} {compile_seconds * 1e3:>8.2f}ms "
+              f"{load_seconds * 1e3:>8.3f}ms {compile_seconds / load_seconds:>7.0f}x")
+
+
+if __name__ == '__main__':
+    main()
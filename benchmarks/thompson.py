@@ -0,0 +1,54 @@
+import time
+
+from the_simplest_computers.regular_expressions import (Choose, Concatenate, Literal, Repeat,
+                                                        ThompsonCompiler)
+
+
+def long_concatenation(nodes):
+    pattern = Literal('a')
+    for i in range(nodes // 2):
+        pattern = Concatenate(pattern, Literal('ab'[i % 2]))
+    return pattern
+
+
+def deep_choice(nodes):
+    pattern = Literal('a')
+    for _ in range(nodes // 4):
+        pattern = Repeat(Choose(Literal('b'), Concatenate(pattern, Literal('c'))))
+    return pattern
+
+
+def timed(function):
+    started = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - started
+
+
+def main():
+    print(f"{'family':<20} {'nodes':>7} {'rules':>8} {'to_nfa_design':>14} "
+          f"{'thompson':>10} {'us/node':>8}")
+    for family in [long_concatenation, deep_choice]:
+        for nodes in [1000, 10000, 100000]:
+            pattern = family(nodes)
+
+            def recursive():
+                try:
+                    return len(pattern.to_nfa_design().rulebook.rules)
+                except RecursionError:
+                    return None
+
+            # the recursive construction overflows the stack well before 100k
+            # nodes and is quadratic in the meantime, so only time it while small
+            recursive_column = 'skipped'
+            if nodes <= 10000:
+                rules, recursive_seconds = timed(recursive)
+                recursive_column = 'RecursionError' if rules is None \
+                    else f"{recursive_seconds:.3f}s"
+
+            nfa_design, seconds = timed(lambda: ThompsonCompiler().to_nfa_design(pattern))
+            print(f"{family.__name__:<20} {nodes:>7} {len(nfa_design.rulebook.rules):>8} "
+                  f"{recursive_column:>14} {seconds:>9.3f}s {seconds / nodes * 1e6:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
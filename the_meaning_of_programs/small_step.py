@@ -35,6 +35,9 @@ class Varible:
     def reduce(self, environment):
         return environment.get(self.name)
 
+    def focus(self):
+        return None
+
 
 class DoNothing:
     reducible = False
@@ -66,6 +69,13 @@ class Add:
         else:
             return Number(self.left.value + self.right.value)
 
+    def focus(self):
+        if self.left.reducible:
+            return self.left, lambda left: Add(left, self.right)
+        elif self.right.reducible:
+            return self.right, lambda right: Add(self.left, right)
+        return None
+
 
 class Multiply:
     reducible = True
@@ -87,6 +97,13 @@ class Multiply:
         else:
             return Number(self.left.value * self.right.value)
 
+    def focus(self):
+        if self.left.reducible:
+            return self.left, lambda left: Multiply(left, self.right)
+        elif self.right.reducible:
+            return self.right, lambda right: Multiply(self.left, right)
+        return None
+
 
 class LessThan:
     reducible = True
@@ -108,6 +125,13 @@ class LessThan:
         else:
             return Boolean(self.left.value < self.right.value)
 
+    def focus(self):
+        if self.left.reducible:
+            return self.left, lambda left: LessThan(left, self.right)
+        elif self.right.reducible:
+            return self.right, lambda right: LessThan(self.left, right)
+        return None
+
 
 class Assign:
     reducible = True
@@ -127,6 +151,11 @@ class Assign:
             environment.update({self.name: self.expression})
             return DoNothing(), environment
 
+    def focus(self):
+        if self.expression.reducible:
+            return self.expression, lambda expression: Assign(self.name, expression)
+        return None
+
 
 class If:
     reducible = True
@@ -150,6 +179,12 @@ class If:
             else:
                 return self.alternative
 
+    def focus(self):
+        if self.condition.reducible:
+            return self.condition, lambda condition: If(condition, self.consequence,
+                                                        self.alternative)
+        return None
+
 
 class Sequence:
     reducible = True
@@ -171,6 +206,11 @@ class Sequence:
         else:
             return self.second, environment
 
+    def focus(self):
+        if self.first != DoNothing():
+            return self.first, lambda first: Sequence(first, self.second)
+        return None
+
 
 class While:
     reducible = True
@@ -185,6 +225,9 @@ class While:
     def reduce(self, environment):
         return If(self.condition, Sequence(self.body, self), DoNothing())
 
+    def focus(self):
+        return None
+
 
 class Machine:
     def __init__(self, expression, environment):
@@ -200,7 +243,69 @@ class Machine:
         return self.expression, self.environment
 
 
+# Reduces the same way as Machine without re-descending from the root each
+# step. focus() names the subexpression a node's next reduction happens
+# inside, with a function that rebuilds the node around its reduced form, or
+# None when the node reduces itself. The machine keeps the redex and a stack
+# of those rebuild functions for the nodes above it; after each reduction it
+# rebuilds only the parent and looks for the next redex from there, which is
+# where Machine's next descent from the root would reach it anyway. Each step
+# costs O(1) amortized instead of O(depth), and deep programs don't hit the
+# recursion limit.
+class ContinuationMachine:
+    def __init__(self, expression, environment):
+        self.environment = environment
+        self.continuation = []
+        self.redex = None
+        self.result = expression
+        self.steps = 0
+        if expression.reducible:
+            self.redex = self.descend(expression)
+
+    @property
+    def expression(self):
+        if self.redex is None:
+            return self.result
+        expression = self.redex
+        for rebuild in reversed(self.continuation):
+            expression = rebuild(expression)
+        return expression
+
+    def descend(self, expression):
+        continuation = self.continuation
+        while expression.reducible:
+            focus = expression.focus()
+            if focus is None:
+                break
+            expression, rebuild = focus
+            continuation.append(rebuild)
+        return expression
+
+    def step(self):
+        if self.redex is None:
+            return False
+        reduced = self.redex.reduce(self.environment)
+        if type(reduced) is tuple:
+            reduced, self.environment = reduced
+        self.steps += 1
+        if self.continuation:
+            self.redex = self.descend(self.continuation.pop()(reduced))
+        elif reduced.reducible:
+            self.redex = self.descend(reduced)
+        else:
+            self.redex = None
+            self.result = reduced
+        return True
+
+    def run(self):
+        while self.step():
+            pass
+        return self.result, self.environment
+
+
 if __name__ == '__main__':
+    import time
+
     exp = Add(Varible('x'), Varible('y'))
     exp_env = {
         'x': Number(3),
@@ -253,3 +358,19 @@ if __name__ == '__main__':
     }
     while_res = Machine(while_exp, while_exp_env).run()
     print('exp:', while_exp, 'res:', while_res)
+
+    # continuation machine
+    machine = ContinuationMachine(while_exp, {'x': Number(1)})
+    machine.step()
+    machine.step()
+    print('exp:', machine.expression, 'steps:', machine.steps)
+    print('res:', machine.run(), 'steps:', machine.steps)
+
+    # a long program: Machine re-descends the growing sequence every step
+    program = Assign('x', Number(0))
+    for _ in range(500):
+        program = Sequence(program, Assign('x', Add(Varible('x'), Number(1))))
+    for machine_class in (Machine, ContinuationMachine):
+        started = time.perf_counter()
+        res = machine_class(program, {}).run()
+        print(machine_class.__name__, res, f"{time.perf_counter() - started:.4f}s")
@@ -0,0 +1,146 @@
+from bisect import bisect_right
+
+from the_simplest_computers.finite_automata import (CharacterRange, DFADesign, DFARulebook, FARule,
+                                                    NFADesign, NFARulebook, NFASimulation)
+
+
+def _bounds(label):
+    if isinstance(label, CharacterRange):
+        return label.bounds
+    return ord(label), ord(label)
+
+
+def _state_key(state):
+    return frozenset(state) if isinstance(state, (set, frozenset)) else state
+
+
+# Splits the code points into intervals at every rule boundary and gives two
+# intervals the same class when exactly the same (state, next state) moves
+# read them. Class 0 is every character that no rule reads.
+class AlphabetPartition:
+    ASCII = 128
+
+    def __init__(self, starts, interval_classes, class_count):
+        self.starts = starts
+        self.interval_classes = interval_classes
+        self.class_count = class_count
+        self.ascii_classes = [self.lookup(code) for code in range(self.ASCII)]
+
+    def __repr__(self):
+        return f"AlphabetPartition {self.class_count} classes over {len(self.starts)} intervals"
+
+    @classmethod
+    def from_rules(cls, rules):
+        labelled = [(_bounds(rule.character), rule) for rule in rules if rule.character is not None]
+        starts = sorted({0} | {first for (first, _), _ in labelled}
+                        | {last + 1 for (_, last), _ in labelled})
+
+        signatures = [set() for _ in starts]
+        for (first, last), rule in labelled:
+            move = (_state_key(rule.status), _state_key(rule.next_status))
+            for interval in range(bisect_right(starts, first) - 1, bisect_right(starts, last)):
+                signatures[interval].add(move)
+
+        classes = {frozenset(): 0}
+        interval_classes = [classes.setdefault(frozenset(signature), len(classes))
+                            for signature in signatures]
+        return cls(starts, interval_classes, len(classes))
+
+    def lookup(self, code):
+        return self.interval_classes[bisect_right(self.starts, code) - 1]
+
+    def class_of(self, character):
+        code = ord(character)
+        if code < self.ASCII:
+            return self.ascii_classes[code]
+        return self.lookup(code)
+
+    def classify(self, string):
+        ascii_classes = self.ascii_classes
+        lookup = self.lookup
+        ascii = self.ASCII
+        return [ascii_classes[code] if code < ascii else lookup(code) for code in map(ord, string)]
+
+    def classes_for(self, label):
+        first, last = _bounds(label)
+        return sorted(set(self.interval_classes[bisect_right(self.starts, first) - 1:
+                                                bisect_right(self.starts, last)]))
+
+    def translate_rules(self, rules):
+        translated = []
+        seen = set()
+        for rule in rules:
+            if rule.character is None:
+                translated.append(rule)
+                continue
+            for symbol in self.classes_for(rule.character):
+                key = (_state_key(rule.status), symbol, _state_key(rule.next_status))
+                if key not in seen:
+                    seen.add(key)
+                    translated.append(FARule(rule.status, symbol, rule.next_status))
+        return translated
+
+
+# An automaton over class ids together with the partition that maps
+# characters onto them.
+class PartitionedDesign:
+    def __init__(self, partition, design):
+        self.partition = partition
+        self.design = design
+
+    def __repr__(self):
+        return f"PartitionedDesign {self.partition} -> {self.design}"
+
+    @classmethod
+    def from_nfa_design(cls, nfa_design):
+        partition = AlphabetPartition.from_rules(nfa_design.rulebook.rules)
+        rules = partition.translate_rules(nfa_design.rulebook.rules)
+        return cls(partition, NFADesign(nfa_design.start_state, nfa_design.accept_states,
+                                        NFARulebook(rules)))
+
+    # Every class lies wholly inside or outside each label, so a class keeps
+    # the one rule its characters followed in each state.
+    @classmethod
+    def from_dfa_design(cls, dfa_design):
+        partition = AlphabetPartition.from_rules(dfa_design.rulebook.rules)
+        rules = partition.translate_rules(dfa_design.rulebook.rules)
+        return cls(partition, DFADesign(dfa_design.start_state, dfa_design.accept_states,
+                                        DFARulebook(rules)))
+
+    def to_dfa_design(self):
+        return PartitionedDesign(self.partition, NFASimulation(self.design).to_dfa_design())
+
+    def compile(self):
+        if not isinstance(self.design, (DFADesign, NFADesign)):
+            return self
+        return PartitionedDesign(self.partition, self.design.compile())
+
+    def minimize(self):
+        return PartitionedDesign(self.partition, self.design.minimize())
+
+    def accepts(self, string):
+        return self.design.accepts(self.partition.classify(string))
+
+
+if __name__ == '__main__':
+    digits = CharacterRange('0', '9')
+    rules = [FARule(1, CharacterRange('a', 'z'), 2), FARule(1, CharacterRange('一', '鿿'), 2),
+             FARule(2, CharacterRange('a', 'z'), 2), FARule(2, digits, 2),
+             FARule(2, CharacterRange('一', '鿿'), 2), FARule(2, '_', 3),
+             FARule(3, digits, 3), FARule(3, 'x', 3)]
+    nfa_design = NFADesign(1, {2, 3}, NFARulebook(rules))
+
+    partition = AlphabetPartition.from_rules(rules)
+    print(partition,
+          [partition.class_of(character) for character in 'ax5_汉é'],
+          partition.classes_for(CharacterRange('a', 'z')))
+
+    design = PartitionedDesign.from_nfa_design(nfa_design)
+    print(design.design.rulebook)
+
+    dfa_design = design.to_dfa_design()
+    table = dfa_design.compile()
+    print(table)
+    for string in ['abc', 'a1汉字', '汉_42', 'a_x9', 'a_b', '9a', 'é', '']:
+        print(repr(string), design.accepts(string), table.accepts(string),
+              design.compile().accepts(string))
@@ -0,0 +1,125 @@
+import numpy as np
+
+from the_simplest_computers.finite_automata import DFATable
+
+
+# Runs many independent strings through a DFATable in lock-step. Every string
+# becomes a row of symbol ids, padded with an extra symbol column that leaves
+# every state where it is, and each input column is one numpy take over the
+# flattened transition table.
+class BatchMatcher:
+    def __init__(self, design):
+        table = design if isinstance(design, DFATable) else design.compile()
+        self.table = table
+
+        states = len(table.states)
+        self.pad_symbol = table.width
+        self.width = table.width + 1
+        self.dtype = np.int32 if states * self.width < 2 ** 31 else np.intp
+        transitions = np.empty((states, self.width), dtype=self.dtype)
+        transitions[:, :-1] = np.asarray(table.transitions).reshape(states, table.width)
+        transitions[:, -1] = np.arange(states)
+        self.transitions = transitions.ravel()
+        self.accept_flags = np.asarray(table.accept_flags, dtype=bool)
+
+        # code point -> symbol id; code points past the end of the lookup
+        # table are clipped onto its last slot, which is the "other" symbol.
+        code_points = [ord(character) for character in table.symbols
+                       if isinstance(character, str) and len(character) == 1]
+        self.lookup = np.full(max(code_points, default=-1) + 2, table.width - 1, dtype=self.dtype)
+        for character, symbol in table.symbols.items():
+            if isinstance(character, str) and len(character) == 1:
+                self.lookup[ord(character)] = symbol
+
+    def __repr__(self):
+        return f"BatchMatcher {self.table}"
+
+    def symbols_for_strings(self, strings):
+        # Map the characters of all strings at once, then scatter them into
+        # rows padded with the pad symbol.
+        lengths = np.fromiter(map(len, strings), dtype=np.intp, count=len(strings))
+        if strings and isinstance(strings[0], (bytes, bytearray)):
+            flat = np.frombuffer(b''.join(strings), dtype=np.uint8)
+        else:
+            flat = np.frombuffer(''.join(strings).encode('utf-32-le'), dtype=np.uint32)
+        symbols = np.full((len(strings), lengths.max(initial=0)), self.pad_symbol,
+                          dtype=self.dtype, order='F')
+        symbols[np.arange(symbols.shape[1]) < lengths[:, None]] = self.lookup_codes(flat)
+        return symbols
+
+    # Codes are widened before clipping: the lookup's last slot can lie past
+    # what the input dtype holds, uint8 against a code point of 255 or more.
+    def lookup_codes(self, codes):
+        return self.lookup.take(np.minimum(codes.astype(np.intp, copy=False),
+                                           len(self.lookup) - 1))
+
+    def symbols_for(self, codes, lengths=None):
+        symbols = self.lookup_codes(np.asarray(codes))
+        if lengths is not None:
+            symbols[np.arange(codes.shape[1]) >= np.asarray(lengths)[:, None]] = self.pad_symbol
+        return symbols
+
+    def run(self, symbols):
+        # column-major, so that every column is contiguous
+        symbols = np.asfortranarray(symbols)
+        transitions = self.transitions
+        states = np.full(len(symbols), self.table.start_state, dtype=self.dtype)
+        for column in symbols.T:
+            states = transitions.take(states * self.width + column)
+        return states
+
+    def accepts(self, strings, lengths=None):
+        if isinstance(strings, np.ndarray):
+            symbols = self.symbols_for(strings, lengths)
+        else:
+            symbols = self.symbols_for_strings(strings)
+        return self.accept_flags.take(self.run(symbols))
+
+
+def batch_accepts(design, strings, lengths=None):
+    return BatchMatcher(design).accepts(strings, lengths)
+
+
+if __name__ == '__main__':
+    import random
+    import time
+
+    from the_simplest_computers.finite_automata import DFADesign, DFARulebook, FARule
+
+    rules = [FARule(1, 'a', 2), FARule(1, 'b', 1),
+             FARule(2, 'a', 2), FARule(2, 'b', 3),
+             FARule(3, 'a', 3), FARule(3, 'b', 3)]
+    dfa_design = DFADesign(1, [3], DFARulebook(rules))
+
+    matcher = BatchMatcher(dfa_design)
+    print(matcher, matcher.accepts(['a', 'baa', 'baba', '', 'bac', 'ab']))
+    print(matcher.accepts([b'ab', b'ba', b'bbbbbbab']))
+    codes = np.array([[98, 97, 98, 0], [97, 97, 0, 0]], dtype=np.uint8)
+    print(matcher.accepts(codes, lengths=[3, 2]))
+
+    # uint8 input against an alphabet reaching past code point 255
+    wide_matcher = BatchMatcher(DFADesign(1, [2], DFARulebook(
+        [FARule(1, 'a', 1), FARule(1, 'ā', 2), FARule(2, 'a', 2)])))
+    print(wide_matcher.accepts(np.array([[97, 97], [97, 0]], dtype=np.uint8), lengths=[2, 1]),
+          wide_matcher.accepts([b'a', b'aa']), wide_matcher.accepts(['aāa', 'aa']))
+
+    random.seed(0)
+    strings = [''.join(random.choice('ab') for _ in range(random.randint(0, 40)))
+               for _ in range(100000)]
+    table = dfa_design.compile()
+
+    started = time.perf_counter()
+    expected = [dfa_design.accepts(string) for string in strings[:1000]]
+    rulebook = (time.perf_counter() - started) * len(strings) / 1000
+
+    started = time.perf_counter()
+    expected = [table.accepts(string) for string in strings]
+    looped = time.perf_counter() - started
+
+    started = time.perf_counter()
+    results = matcher.accepts(strings)
+    batched = time.perf_counter() - started
+
+    assert results.tolist() == expected
+    print(f"{len(strings)} strings: rulebook ~{rulebook:.3f}s, table {looped:.3f}s, "
+          f"batch {batched:.3f}s ({rulebook / batched:.0f}x, {looped / batched:.1f}x)")
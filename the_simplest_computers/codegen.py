@@ -0,0 +1,197 @@
+import hashlib
+from collections import OrderedDict
+
+from the_simplest_computers.finite_automata import DFADesign, DFATable
+
+# Tables with more states than this, or whose source would run past
+# max_lines, are left to the table engine. benchmarks/automata.py --only
+# codegen has generated code level with the table at 16 states on input that
+# changes state every other character and behind it from 24 on, while input
+# that mostly keeps the state runs about twice as fast at any size; callers
+# expecting that kind of input, like lexers, can pass a larger max_states.
+MAX_STATES = 16
+MAX_LINES = 20000
+# A state with more distinct targets than this dispatches through a dict
+# rather than a chain of comparisons.
+MAX_BRANCHES = 4
+MAXCACHE = 64
+_cache = OrderedDict()
+
+
+def fingerprint(table):
+    digest = hashlib.sha256()
+    digest.update(repr((list(table.symbols.items()), table.start_state)).encode())
+    digest.update(repr(list(table.transitions)).encode())
+    digest.update(bytes(bool(flag) for flag in table.accept_flags))
+    return digest.hexdigest()
+
+
+def _literal(character):
+    return isinstance(character, (str, int)) and not isinstance(character, bool)
+
+
+# Writes run(state, string) for table. A binary tree of comparisons picks the
+# block for the current state, and each block reads characters in its own
+# loop for as long as they keep the automaton in that state, so a state is
+# only dispatched on when it changes. The next state is found with a few
+# comparisons against the characters that lead somewhere, or one lookup in a
+# per-state dict when there are many. Characters outside the alphabet go
+# wherever the table's last column sends them, and a state that no character
+# leaves, like the dead state, returns straight away. Returns the source and
+# the dicts it refers to.
+def generate_source(table):
+    width = table.width
+    transitions = table.transitions
+    rows = {}
+    lines = ['def run(state, string):',
+             '    characters = iter(string)',
+             '    while True:']
+
+    def block(state, indent):
+        pad = ' ' * indent
+        row = state * width
+        other = transitions[row + width - 1]
+        targets = {}
+        for character, symbol in table.symbols.items():
+            next_state = transitions[row + symbol]
+            if next_state != other:
+                targets.setdefault(next_state, []).append(character)
+
+        if not targets and other == state:
+            lines.append(f"{pad}return {state}")
+            return
+
+        lines.append(f"{pad}for character in characters:")
+        inner = pad + '    '
+        if len(targets) > MAX_BRANCHES or not all(_literal(character) for characters in
+                                                  targets.values() for character in characters):
+            name = f"row_{state}"
+            rows[name] = {character: next_state for next_state, characters in targets.items()
+                          for character in characters}
+            lines.append(f"{inner}state = {name}.get(character, {other})")
+            lines.append(f"{inner}if state != {state}:")
+            lines.append(f"{inner}    break")
+        else:
+            # staying put is tested first, then the busiest target
+            keyword = 'if'
+            for next_state, characters in sorted(targets.items(),
+                                                 key=lambda item: (item[0] != state, -len(item[1]))):
+                if len(characters) == 1:
+                    test = f"character == {characters[0]!r}"
+                else:
+                    test = f"character in {{{', '.join(repr(c) for c in characters)}}}"
+                lines.append(f"{inner}{keyword} {test}:")
+                lines.append(f"{inner}    {'continue' if next_state == state else f'state = {next_state}'}")
+                keyword = 'elif'
+            if other == state:
+                lines.append(f"{inner}else:")
+                lines.append(f"{inner}    continue")
+            elif targets:
+                lines.append(f"{inner}else:")
+                lines.append(f"{inner}    state = {other}")
+            else:
+                lines.append(f"{inner}state = {other}")
+            lines.append(f"{inner}break")
+        lines.append(f"{pad}else:")
+        lines.append(f"{pad}    return {state}")
+
+    # iterative so that large tables don't hit the recursion limit; states
+    # lo..hi-1 are split in half until one is left
+    stack = [(0, len(table.states), 8)]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            lines.append(item)
+            continue
+        lo, hi, indent = item
+        if hi - lo == 1:
+            block(lo, indent)
+            continue
+        middle = (lo + hi) // 2
+        pad = ' ' * indent
+        lines.append(f"{pad}if state < {middle}:")
+        stack.append((middle, hi, indent + 4))
+        stack.append(f"{pad}else:")
+        stack.append((lo, middle, indent + 4))
+    return '\n'.join(lines) + '\n', rows
+
+
+# A DFATable whose run is a function generated for this table alone.
+class GeneratedDFATable(DFATable):
+    def __init__(self, table, source, function):
+        super().__init__(table.states, table.symbols, table.transitions, table.accept_flags,
+                         table.start_state)
+        self.source = source
+        self.run = function
+
+    def __repr__(self):
+        return f"GeneratedDFATable {len(self.states)} states x {len(self.symbols)} symbols"
+
+
+# Returns table with a generated run function, or the table itself when it is
+# too large to generate code for. Generated functions are cached by
+# fingerprint, so equal tables share one.
+def generated(design, max_states=MAX_STATES, max_lines=MAX_LINES):
+    table = design.compile() if isinstance(design, DFADesign) else design
+    if isinstance(table, GeneratedDFATable):
+        return table
+    if len(table.states) > max_states:
+        return table
+
+    key = fingerprint(table)
+    entry = _cache.get(key)
+    if entry is not None:
+        _cache.move_to_end(key)
+    else:
+        source, rows = generate_source(table)
+        if source.count('\n') > max_lines:
+            return table
+        namespace = dict(rows)
+        exec(compile(source, f"<dfa {key[:12]}>", 'exec'), namespace)
+        entry = _cache[key] = (source, namespace['run'])
+        if len(_cache) > MAXCACHE:
+            _cache.popitem(last=False)
+    return GeneratedDFATable(table, *entry)
+
+
+def purge():
+    _cache.clear()
+
+
+if __name__ == '__main__':
+    import random
+
+    from the_simplest_computers.finite_automata import DFARulebook, FARule
+
+    rules = [FARule(1, 'a', 2), FARule(1, 'b', 1),
+             FARule(2, 'a', 2), FARule(2, 'b', 3),
+             FARule(3, 'a', 3), FARule(3, 'b', 3)]
+    dfa_design = DFADesign(1, [3], DFARulebook(rules))
+    generated_table = generated(dfa_design)
+    print(generated_table)
+    print(generated_table.source)
+    print(generated_table.accepts('a'),
+          generated_table.accepts('baa'),
+          generated_table.accepts('baba'),
+          generated_table.accepts('abc'))
+    print(generated(dfa_design).run is generated_table.run)
+
+    dfa = generated_table.to_dfa()
+    dfa.read_string('bab')
+    print(dfa.accepting())
+
+    # random DFAs agree with the table engine
+    random.seed(0)
+    for size in [1, 2, 5, 40, 300]:
+        alphabet = 'abcdefgh'[:random.randint(1, 8)]
+        rules = [FARule(state, character, random.randrange(size))
+                 for state in range(size) for character in alphabet if random.random() < 0.8]
+        design = DFADesign(0, [s for s in range(size) if random.random() < 0.3],
+                           DFARulebook(rules))
+        table = design.compile()
+        generated_table = generated(table, max_states=1024)
+        strings = [''.join(random.choice(alphabet + 'z') for _ in range(random.randint(0, 30)))
+                   for _ in range(200)]
+        print(size, all(table.accepts(s) == generated_table.accepts(s) for s in strings))
+
+    print(generated(design, max_states=10))
@@ -0,0 +1,464 @@
+from collections import OrderedDict
+
+from the_simplest_computers.alphabet import AlphabetPartition
+from the_simplest_computers.finite_automata import FARule
+from the_simplest_computers.regular_expressions import (CharacterClass, Choose, Concatenate, Counted,
+                                                        Empty, Group, Literal, Optional, Pattern,
+                                                        Plus, Repeat)
+
+
+# Patterns only the derivative matcher understands. There is no NFA for
+# them, so the Thompson construction raises TypeError, and Pattern.matches
+# runs any tree containing one on a DerivativeDesign built here.
+class DerivativePattern(Pattern):
+    derivative_only = True
+
+    def thompson(self, compiler, fragments):
+        raise TypeError(f"{type(self).__name__} patterns have no NFA; "
+                        f"match them with DerivativeDesign")
+
+    @staticmethod
+    def derivative_design(pattern):
+        return DerivativeDesign(pattern)
+
+
+class Intersect(DerivativePattern):
+    precedence = 0
+
+    def __init__(self, first, second):
+        self.first = first
+        self.second = second
+
+    def __repr__(self):
+        return '&'.join(i.bracket(self.precedence + 1) for i in [self.first, self.second])
+
+    def children(self):
+        return self.first, self.second
+
+
+class Complement(DerivativePattern):
+    precedence = 2
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+    def __repr__(self):
+        return '~' + self.pattern.bracket(3)
+
+    def children(self):
+        return self.pattern,
+
+
+EMPTY, NOTHING, CHARACTERS, CONCATENATE, CHOOSE, INTERSECT, REPEAT, COMPLEMENT = range(8)
+
+
+class DerivativeStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.collections = 0
+        self.terms_collected = 0
+        self.cache_size = 0
+        self.terms = 0
+
+    def __repr__(self):
+        return (f"DerivativeStats hits={self.hits} misses={self.misses} "
+                f"hit_rate={self.hit_rate:.3f} cache_size={self.cache_size} terms={self.terms} "
+                f"evictions={self.evictions} collections={self.collections} "
+                f"terms_collected={self.terms_collected}")
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+# Matches by taking Brzozowski derivatives of the pattern itself, no NFA
+# involved. Patterns become hash-consed terms, numbered in kinds/args, built
+# only through constructors that simplify them (ε and ∅ units, flattened and
+# deduplicated alternatives, r** = r*, ~~r = r), so every distinct derivative
+# is one term and serves as a lazily built DFA state. Characters are read as
+# the alphabet classes of the pattern's characters and ranges, which no
+# derivative can tell apart.
+#
+# (term, class) -> term transitions live in an LRU cache of max_transitions
+# entries. Once there are more than max_terms terms, those not reachable from
+# the start term or the current one are collected and the rest renumbered, so
+# a DerivativeDFA is only safe to use while no other run is collecting.
+class DerivativeDesign:
+    def __init__(self, pattern, max_transitions=1 << 16, max_terms=1 << 16):
+        self.pattern = pattern
+        self.max_transitions = max_transitions
+        self.max_terms = max_terms
+        self.cache = OrderedDict()
+        self.stats = DerivativeStats()
+        self.partition = AlphabetPartition.from_rules(
+            [FARule(i, label, i) for i, label in enumerate(self.labels(pattern))])
+
+        self.kinds = []
+        self.args = []
+        self.nullable = []
+        self.ids = {}
+        self.intern(EMPTY, ())
+        self.intern(NOTHING, ())
+        self.anything = self.complement(NOTHING)
+        self.start_term = self.term(pattern)
+
+    def __repr__(self):
+        return f"DerivativeDesign {len(self.kinds)} terms, {len(self.cache)} transitions"
+
+    @staticmethod
+    def labels(pattern):
+        labels = []
+        stack = [pattern]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, Literal):
+                labels.append(node.character)
+            elif isinstance(node, CharacterClass):
+                labels.extend(node.ranges)
+            stack.extend(node.children())
+        return labels
+
+    def intern(self, kind, args):
+        key = (kind, args)
+        term = self.ids.get(key)
+        if term is None:
+            term = self.ids[key] = len(self.kinds)
+            self.kinds.append(kind)
+            self.args.append(args)
+            nullable = self.nullable
+            if kind == EMPTY or kind == REPEAT:
+                self.nullable.append(True)
+            elif kind == CONCATENATE:
+                self.nullable.append(nullable[args[0]] and nullable[args[1]])
+            elif kind == CHOOSE:
+                self.nullable.append(any(nullable[arg] for arg in args))
+            elif kind == INTERSECT:
+                self.nullable.append(all(nullable[arg] for arg in args))
+            elif kind == COMPLEMENT:
+                self.nullable.append(not nullable[args])
+            else:
+                self.nullable.append(False)
+        return term
+
+    def characters(self, classes):
+        return self.intern(CHARACTERS, frozenset(classes)) if classes else NOTHING
+
+    def concatenate(self, first, second):
+        if first == NOTHING or second == NOTHING:
+            return NOTHING
+        # kept right-nested: (ab)c becomes a(bc)
+        firsts = []
+        stack = [first]
+        while stack:
+            term = stack.pop()
+            if self.kinds[term] == CONCATENATE:
+                stack.extend(reversed(self.args[term]))
+            else:
+                firsts.append(term)
+        for term in reversed(firsts):
+            if term == EMPTY:
+                continue
+            if second != EMPTY:
+                term = self.intern(CONCATENATE, (term, second))
+            second = term
+        return second
+
+    def choose(self, terms):
+        flat = set()
+        for term in terms:
+            if self.kinds[term] == CHOOSE:
+                flat.update(self.args[term])
+            elif term != NOTHING:
+                flat.add(term)
+        if self.anything in flat:
+            return self.anything
+        if len(flat) <= 1:
+            return flat.pop() if flat else NOTHING
+        return self.intern(CHOOSE, frozenset(flat))
+
+    def intersect(self, terms):
+        flat = set()
+        for term in terms:
+            if self.kinds[term] == INTERSECT:
+                flat.update(self.args[term])
+            elif term != self.anything:
+                flat.add(term)
+        if NOTHING in flat:
+            return NOTHING
+        if len(flat) <= 1:
+            return flat.pop() if flat else self.anything
+        return self.intern(INTERSECT, frozenset(flat))
+
+    def repeat(self, term):
+        if term == EMPTY or term == NOTHING:
+            return EMPTY
+        if self.kinds[term] == REPEAT:
+            return term
+        return self.intern(REPEAT, term)
+
+    def complement(self, term):
+        if self.kinds[term] == COMPLEMENT:
+            return self.args[term]
+        return self.intern(COMPLEMENT, term)
+
+    def counted(self, term, minimum, maximum):
+        if maximum is None:
+            tail = self.repeat(term)
+        else:
+            tail = EMPTY
+            for _ in range(maximum - minimum):
+                tail = self.choose([EMPTY, self.concatenate(term, tail)])
+        for _ in range(minimum):
+            tail = self.concatenate(term, tail)
+        return tail
+
+    def term(self, pattern):
+        terms = {}
+        stack = [(pattern, False)]
+        while stack:
+            node, expanded = stack.pop()
+            children = node.children()
+            if not expanded and children:
+                stack.append((node, True))
+                stack.extend((child, False) for child in children if id(child) not in terms)
+                continue
+
+            arguments = [terms[id(child)] for child in children]
+            if isinstance(node, Empty):
+                term = EMPTY
+            elif isinstance(node, Literal):
+                term = self.characters(self.partition.classes_for(node.character))
+            elif isinstance(node, CharacterClass):
+                term = self.characters({symbol for item in node.ranges
+                                        for symbol in self.partition.classes_for(item)})
+            elif isinstance(node, Concatenate):
+                term = self.concatenate(*arguments)
+            elif isinstance(node, Choose):
+                term = self.choose(arguments)
+            elif isinstance(node, Intersect):
+                term = self.intersect(arguments)
+            elif isinstance(node, Repeat):
+                term = self.repeat(*arguments)
+            elif isinstance(node, Plus):
+                term = self.concatenate(arguments[0], self.repeat(arguments[0]))
+            elif isinstance(node, Optional):
+                term = self.choose([EMPTY, arguments[0]])
+            elif isinstance(node, Counted):
+                term = self.counted(arguments[0], node.minimum, node.maximum)
+            elif isinstance(node, Complement):
+                term = self.complement(*arguments)
+            elif isinstance(node, Group):
+                term, = arguments
+            else:
+                raise TypeError(f"no derivative for {type(node).__name__}")
+            terms[id(node)] = term
+        return terms[id(pattern)]
+
+    def needs(self, term):
+        kind = self.kinds[term]
+        if kind == CONCATENATE:
+            first, second = self.args[term]
+            return (first, second) if self.nullable[first] else (first,)
+        if kind == CHOOSE or kind == INTERSECT:
+            return self.args[term]
+        if kind == REPEAT or kind == COMPLEMENT:
+            return self.args[term],
+        return ()
+
+    # The derivative of term with respect to one alphabet class, worked out
+    # bottom-up from an explicit stack with every subterm's derivative kept
+    # in the cache along the way.
+    def derivative(self, term, symbol):
+        cache = self.cache
+        derived = {}
+
+        def known(term):
+            next_term = derived.get(term)
+            if next_term is None:
+                next_term = cache.get((term, symbol))
+            return next_term
+
+        stack = [term]
+        while stack:
+            current = stack[-1]
+            if known(current) is not None:
+                stack.pop()
+                continue
+            missing = [needed for needed in self.needs(current) if known(needed) is None]
+            if missing:
+                stack.extend(missing)
+                continue
+            stack.pop()
+
+            kind = self.kinds[current]
+            args = self.args[current]
+            if kind == CHARACTERS:
+                next_term = EMPTY if symbol in args else NOTHING
+            elif kind == CONCATENATE:
+                first, second = args
+                next_term = self.concatenate(known(first), second)
+                if self.nullable[first]:
+                    next_term = self.choose([next_term, known(second)])
+            elif kind == CHOOSE:
+                next_term = self.choose([known(arg) for arg in args])
+            elif kind == INTERSECT:
+                next_term = self.intersect([known(arg) for arg in args])
+            elif kind == REPEAT:
+                next_term = self.concatenate(known(args), current)
+            elif kind == COMPLEMENT:
+                next_term = self.complement(known(args))
+            else:
+                next_term = NOTHING
+            derived[current] = next_term
+
+        for current, next_term in derived.items():
+            self.store((current, symbol), next_term)
+        return known(term)
+
+    def store(self, key, next_term):
+        self.cache[key] = next_term
+        while len(self.cache) > self.max_transitions:
+            self.cache.popitem(last=False)
+            self.stats.evictions += 1
+
+    # Keeps the terms reachable from roots, renumbered in their old order so
+    # arguments still come before the terms using them, and the transitions
+    # among them. Returns the roots' new numbers.
+    def collect(self, roots):
+        live = [False] * len(self.kinds)
+        live[EMPTY] = live[NOTHING] = True
+        stack = [self.anything, self.start_term] + list(roots)
+        while stack:
+            term = stack.pop()
+            if live[term]:
+                continue
+            live[term] = True
+            args = self.args[term]
+            if isinstance(args, int):
+                stack.append(args)
+            elif self.kinds[term] != CHARACTERS:
+                stack.extend(args)
+
+        numbers = {}
+        kinds, all_args = self.kinds, self.args
+        self.kinds, self.args, self.nullable, self.ids = [], [], [], {}
+        for term, kind in enumerate(kinds):
+            if not live[term]:
+                continue
+            args = all_args[term]
+            if isinstance(args, int):
+                args = numbers[args]
+            elif kind == CONCATENATE:
+                args = tuple(numbers[arg] for arg in args)
+            elif kind == CHOOSE or kind == INTERSECT:
+                args = frozenset(numbers[arg] for arg in args)
+            numbers[term] = self.intern(kind, args)
+
+        cache = OrderedDict()
+        for (term, symbol), next_term in self.cache.items():
+            if term in numbers and next_term in numbers:
+                cache[(numbers[term], symbol)] = numbers[next_term]
+        self.cache = cache
+        self.anything = numbers[self.anything]
+        self.start_term = numbers[self.start_term]
+        self.stats.collections += 1
+        self.stats.terms_collected += len(kinds) - len(self.kinds)
+        return [numbers[root] for root in roots]
+
+    def next_term(self, term, character):
+        return self.run(term, character)
+
+    def run(self, term, string):
+        cache = self.cache
+        stats = self.stats
+        class_of = self.partition.class_of
+        for character in string:
+            key = (term, class_of(character))
+            next_term = cache.get(key)
+            if next_term is None:
+                stats.misses += 1
+                next_term = self.derivative(*key)
+                if len(self.kinds) > self.max_terms:
+                    next_term, = self.collect([next_term])
+                    cache = self.cache
+            else:
+                stats.hits += 1
+                cache.move_to_end(key)
+            term = next_term
+            if term == NOTHING:
+                break
+        stats.cache_size = len(self.cache)
+        stats.terms = len(self.kinds)
+        return term
+
+    def accepting(self, term):
+        return self.nullable[term]
+
+    def to_dfa(self):
+        return DerivativeDFA(self.start_term, self)
+
+    def accepts(self, string):
+        term = self.run(self.start_term, string)
+        return self.nullable[term]
+
+
+class DerivativeDFA:
+    def __init__(self, current_term, design):
+        self.current_term = current_term
+        self.design = design
+
+    def accepting(self):
+        return self.design.accepting(self.current_term)
+
+    def read_character(self, character):
+        self.read_string(character)
+
+    def read_string(self, string):
+        self.current_term = self.design.run(self.current_term, string)
+
+
+if __name__ == '__main__':
+    import random
+
+    from the_simplest_computers.regular_expressions import compile, parse
+
+    design = DerivativeDesign(parse('(a|b)*a(a|b){5}'))
+    print(design.accepts('abbbbb'), design.accepts('babbbbb'), design.accepts('bbbbbb'), design)
+
+    dfa = design.to_dfa()
+    dfa.read_string('bbab')
+    print(dfa.accepting(), design.stats)
+
+    # intersection and complement: identifiers that are not keywords
+    identifier = parse('[a-z_][a-z0-9_]*')
+    keywords = parse('if|else|while')
+    design = DerivativeDesign(Intersect(identifier, Complement(keywords)))
+    print(Intersect(identifier, Complement(keywords)),
+          [(word, design.accepts(word)) for word in ['if', 'iffy', 'while', 'x1', '1x', '']])
+    print(Intersect(parse('a*'), parse('aa')).matches('aa'),
+          Complement(parse('a*')).matches('aa'))
+    # nested anywhere in an ordinary tree, too
+    print(Concatenate(Literal('b'), Complement(parse('a*'))).matches('baa'),
+          Concatenate(Literal('b'), Complement(parse('a*'))).matches('bab'),
+          Repeat(Choose(Literal('x'), Intersect(parse('[a-c]+'), parse('b*')))).matches('xbbxb'))
+    for pattern in [Intersect(parse('a*'), parse('aa')),
+                    Concatenate(Literal('b'), Complement(parse('a*')))]:
+        try:
+            pattern.compile().fullmatch('baa')
+        except TypeError as error:
+            print(error)
+    print(DerivativeDesign(Complement(parse('(a|b)*abb(a|b)*'))).accepts('ababab'),
+          DerivativeDesign(Intersect(parse('(ab)*'), parse('(a|b){4}'))).accepts('abab'))
+
+    random.seed(0)
+    source = '(a|b)*a(a|b){8}'
+    strings = [''.join(random.choice('ab') for _ in range(300)) for _ in range(200)]
+    expected = [compile(source).fullmatch(string) for string in strings]
+    for design in [DerivativeDesign(parse(source)),
+                   DerivativeDesign(parse(source), max_transitions=64),
+                   DerivativeDesign(parse(source), max_transitions=64, max_terms=64)]:
+        assert [design.accepts(string) for string in strings] == expected
+        print(design, design.stats)
@@ -1,8 +1,57 @@
+import time
+from array import array
+from collections import deque
+from collections.abc import Sequence
 from itertools import chain
 from typing import List
 
 
+def _frozen(state):
+    if isinstance(state, (set, frozenset)):
+        return frozenset(state)
+    return state
+
+
+def _ranged(rules):
+    return any(isinstance(rule.character, CharacterRange) for rule in rules)
+
+
+def _unranged(rules, kind):
+    if _ranged(rules):
+        raise TypeError(f"{kind} cannot read CharacterRange labels; "
+                        f"compile the design through PartitionedDesign")
+
+
+# A rule label reading every character from first to last inclusive.
+class CharacterRange:
+    def __init__(self, first, last):
+        if ord(first) > ord(last):
+            raise ValueError(f"empty character range {first!r}-{last!r}")
+        self.first = first
+        self.last = last
+
+    def __repr__(self):
+        return f"{self.first}-{self.last}"
+
+    def __eq__(self, other):
+        if isinstance(other, CharacterRange):
+            return self.first == other.first and self.last == other.last
+        return False
+
+    def __hash__(self):
+        return hash((CharacterRange, self.first, self.last))
+
+    def __contains__(self, character):
+        return self.first <= character <= self.last
+
+    @property
+    def bounds(self):
+        return ord(self.first), ord(self.last)
+
+
 class FARule:
+    __slots__ = ('status', 'character', 'next_status')
+
     def __init__(self, status, character, next_status):
         self.status = status
         self.character = character
@@ -20,15 +69,112 @@ class FARule:
         return False
 
     def __hash__(self):
-        return hash((*self.status, self.character, *self.next_status))
+        return hash((_frozen(self.status), self.character, _frozen(self.next_status)))
 
     def applies_to(self, status, character):
-        return self.status == status and self.character == character
+        if self.status != status:
+            return False
+        if isinstance(self.character, CharacterRange) and isinstance(character, str):
+            return character in self.character
+        return self.character == character
 
     def follow(self):
         return self.next_status
 
 
+# Rules stored as three array columns over interned ids: states are numbered
+# in order of appearance, characters are numbered with -1 for free moves, and
+# labels/characters map the ids back for display. Indexing yields FARules
+# over state ids, so the columns can stand in for a list of rules; the
+# column rulebooks below read the arrays without building them.
+class RuleColumns(Sequence):
+    def __init__(self, rules=()):
+        self.labels = []
+        self.state_ids = {}
+        self.characters = []
+        self.character_ids = {None: -1}
+        self.status = array('i')
+        self.character = array('i')
+        self.next_status = array('i')
+        self.runs = None
+        for rule in rules:
+            self.append(rule.status, rule.character, rule.next_status)
+
+    def __repr__(self):
+        return f"RuleColumns {len(self)} rules over {len(self.labels)} states"
+
+    def __len__(self):
+        return len(self.status)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        character = self.character[i]
+        return FARule(self.status[i], None if character < 0 else self.characters[character],
+                      self.next_status[i])
+
+    def state_id(self, state):
+        key = _frozen(state)
+        state_id = self.state_ids.get(key)
+        if state_id is None:
+            state_id = self.state_ids[key] = len(self.labels)
+            self.labels.append(state)
+        return state_id
+
+    def character_id(self, character):
+        character_id = self.character_ids.get(character)
+        if character_id is None:
+            character_id = self.character_ids[character] = len(self.characters)
+            self.characters.append(character)
+        return character_id
+
+    def append(self, status, character, next_status):
+        self.status.append(self.state_id(status))
+        self.character.append(self.character_id(character))
+        self.next_status.append(self.state_id(next_status))
+
+    def label(self, state_id):
+        return self.labels[state_id]
+
+    def labelled(self, i):
+        return FARule(self.labels[self.status[i]], self[i].character,
+                      self.labels[self.next_status[i]])
+
+    # Rule indices ordered by state, keeping the rules' order within a state,
+    # and the offset where each state's run starts: a counting sort, redone
+    # when rules have been appended since.
+    def state_runs(self):
+        if self.runs is None or self.runs[0] != len(self):
+            offsets = array('i', bytes(4 * (len(self.labels) + 1)))
+            for state in self.status:
+                offsets[state + 1] += 1
+            for state in range(len(self.labels)):
+                offsets[state + 1] += offsets[state]
+            order = array('i', bytes(4 * len(self)))
+            filled = offsets[:-1]
+            for i, state in enumerate(self.status):
+                order[filled[state]] = i
+                filled[state] += 1
+            ranges = {character_id: character
+                      for character_id, character in enumerate(self.characters)
+                      if isinstance(character, CharacterRange)}
+            self.runs = (len(self), order, offsets, ranges)
+        return self.runs[1:]
+
+    # Indices of the rules from state that read character, in rule order.
+    def matching(self, state, character):
+        order, offsets, ranges = self.state_runs()
+        character_id = self.character_ids.get(character, -2)
+        characters = self.character
+        found = [i for i in order[offsets[state]:offsets[state + 1]]
+                 if characters[i] == character_id]
+        if ranges and isinstance(character, str):
+            found.extend(i for i in order[offsets[state]:offsets[state + 1]]
+                         if characters[i] in ranges and character in ranges[characters[i]])
+            found.sort()
+        return found
+
+
 class DFARulebook:
     def __init__(self, rules):
         self.rules = rules
@@ -45,6 +191,20 @@ class DFARulebook:
                 return rule
 
 
+# A DFARulebook over RuleColumns, for interned designs: only the rules of the
+# current state are scanned, comparing character ids.
+class ColumnDFARulebook(DFARulebook):
+    def next_state(self, state, character):
+        found = self.rules.matching(state, character)
+        if not found:
+            return self.rule_for(state, character).follow()
+        return self.rules.next_status[found[0]]
+
+    def rule_for(self, state, character):
+        found = self.rules.matching(state, character)
+        return self.rules[found[0]] if found else None
+
+
 class DFA:
     def __init__(self, current_state, accept_states, rulebook):
         self.current_state = current_state
@@ -76,6 +236,225 @@ class DFADesign:
         dfa.read_string(string)
         return dfa.accepting()
 
+    # A design with CharacterRange labels compiles to a table over alphabet
+    # classes behind a PartitionedDesign (alphabet imports this module, hence
+    # the late import).
+    def compile(self):
+        if _ranged(self.rulebook.rules):
+            from the_simplest_computers.alphabet import PartitionedDesign
+            return PartitionedDesign.from_dfa_design(self).compile()
+        return DFATable.from_dfa_design(self)
+
+    def interned(self):
+        columns = RuleColumns()
+        start_state = columns.state_id(self.start_state)
+        for rule in self.rulebook.rules:
+            columns.append(rule.status, rule.character, rule.next_status)
+        accept_states = [columns.state_id(state) for state in self.accept_states]
+        return DFADesign(start_state, accept_states, ColumnDFARulebook(columns))
+
+    def minimize(self):
+        return self.compile().minimize()
+
+    def intersection(self, other):
+        return self.product(other, lambda first, second: first and second)
+
+    def union(self, other):
+        return self.product(other, lambda first, second: first or second)
+
+    def difference(self, other):
+        return self.product(other, lambda first, second: first and not second)
+
+    def product(self, other, accept):
+        _unranged(chain(self.rulebook.rules, other.rulebook.rules), 'DFADesign.product')
+        return self.compile().product(other.compile(), accept)
+
+
+# transitions is a flat list indexed by state * width + symbol. The last symbol
+# column catches characters outside the alphabet and the last state is the dead
+# state that every missing rule leads to.
+class DFATable:
+    def __init__(self, states, symbols, transitions, accept_flags, start_state):
+        self.states = states
+        self.symbols = symbols
+        self.transitions = transitions
+        self.accept_flags = accept_flags
+        self.start_state = start_state
+        self.width = len(symbols) + 1
+
+    def __repr__(self):
+        return f"DFATable {len(self.states)} states x {len(self.symbols)} symbols"
+
+    @property
+    def dead_state(self):
+        return len(self.states) - 1
+
+    @classmethod
+    def from_dfa_design(cls, dfa_design):
+        index = {}
+        states = []
+
+        def intern(state):
+            key = _frozen(state)
+            if key not in index:
+                index[key] = len(states)
+                states.append(state)
+            return index[key]
+
+        rules = dfa_design.rulebook.rules
+        _unranged(rules, 'DFATable')
+        start_state = intern(dfa_design.start_state)
+        symbols = {}
+        for rule in rules:
+            intern(rule.status)
+            intern(rule.next_status)
+            symbols.setdefault(rule.character, len(symbols))
+
+        dead_state = len(states)
+        states.append(None)
+        width = len(symbols) + 1
+        transitions = [dead_state] * (width * len(states))
+
+        # DFARulebook.rule_for returns the first applicable rule, so later
+        # duplicates for the same (state, character) are ignored.
+        filled = set()
+        for rule in rules:
+            slot = index[_frozen(rule.status)] * width + symbols[rule.character]
+            if slot not in filled:
+                filled.add(slot)
+                transitions[slot] = index[_frozen(rule.next_status)]
+
+        accept_flags = [state in dfa_design.accept_states for state in states[:-1]] + [False]
+        return cls(states, symbols, transitions, accept_flags, start_state)
+
+    def next_state(self, state, character):
+        symbol = self.symbols.get(character, self.width - 1)
+        return self.transitions[state * self.width + symbol]
+
+    def run(self, state, string):
+        symbols = self.symbols
+        transitions = self.transitions
+        width = self.width
+        other = width - 1
+        for character in string:
+            state = transitions[state * width + symbols.get(character, other)]
+        return state
+
+    def reachable_states(self):
+        symbols = range(len(self.symbols))
+        seen = {self.start_state}
+        stack = [self.start_state]
+        while stack:
+            row = stack.pop() * self.width
+            for symbol in symbols:
+                next_state = self.transitions[row + symbol]
+                if next_state not in seen:
+                    seen.add(next_state)
+                    stack.append(next_state)
+        return seen
+
+    def minimize(self):
+        # Hopcroft partition refinement over the reachable states. A missing
+        # rule leads to the dead state, which becomes an explicit state of
+        # the result if it is reachable at all.
+        states = self.reachable_states()
+        symbols = range(len(self.symbols))
+        predecessors = [{} for _ in symbols]
+        for state in states:
+            row = state * self.width
+            for symbol in symbols:
+                predecessors[symbol].setdefault(self.transitions[row + symbol], []).append(state)
+
+        blocks = [block for block in ({s for s in states if self.accept_flags[s]},
+                                      {s for s in states if not self.accept_flags[s]})
+                  if block]
+        block_of = {state: i for i, block in enumerate(blocks) for state in block}
+        work = {min(range(len(blocks)), key=lambda i: len(blocks[i]))}
+
+        while work:
+            splitter = list(blocks[work.pop()])
+            for symbol in symbols:
+                symbol_predecessors = predecessors[symbol]
+                touched = {}
+                for target in splitter:
+                    for state in symbol_predecessors.get(target, ()):
+                        touched.setdefault(block_of[state], set()).add(state)
+                for i, inside in touched.items():
+                    block = blocks[i]
+                    if len(inside) == len(block):
+                        continue
+                    # in place, so a split costs O(len(inside)); the smaller
+                    # half becomes the new block and is the one relabelled
+                    block -= inside
+                    if len(inside) <= len(block):
+                        new_block = inside
+                    else:
+                        blocks[i], new_block = inside, block
+                    blocks.append(new_block)
+                    for state in new_block:
+                        block_of[state] = len(blocks) - 1
+                    work.add(len(blocks) - 1)
+
+        labels = {block_of[self.start_state]: 0}
+        order = [block_of[self.start_state]]
+        rules = []
+        for i in order:
+            row = next(iter(blocks[i])) * self.width
+            for character, symbol in self.symbols.items():
+                target = block_of[self.transitions[row + symbol]]
+                if target not in labels:
+                    labels[target] = len(order)
+                    order.append(target)
+                rules.append(FARule(labels[i], character, labels[target]))
+
+        accept_states = {labels[i] for i in order if self.accept_flags[next(iter(blocks[i]))]}
+        return DFADesign(0, accept_states, DFARulebook(rules))
+
+    def product(self, other, accept):
+        # Runs both tables side by side over the union of their alphabets; a
+        # character that one of them has never seen sends it to its dead state.
+        characters = list(self.symbols) + [c for c in other.symbols if c not in self.symbols]
+        start_state = (self.start_state, other.start_state)
+        labels = {start_state: 0}
+        pairs = [start_state]
+        rules = []
+        for first, second in pairs:
+            for character in characters:
+                next_state = (self.next_state(first, character), other.next_state(second, character))
+                if next_state not in labels:
+                    labels[next_state] = len(pairs)
+                    pairs.append(next_state)
+                rules.append(FARule(labels[(first, second)], character, labels[next_state]))
+
+        accept_states = {labels[pair] for pair in pairs
+                         if accept(self.accept_flags[pair[0]], other.accept_flags[pair[1]])}
+        return DFADesign(0, accept_states, DFARulebook(rules))
+
+    def to_dfa(self):
+        return TableDFA(self.start_state, self)
+
+    def accepts(self, string):
+        return self.accept_flags[self.run(self.start_state, string)]
+
+
+class TableDFA:
+    def __init__(self, current_state, table):
+        self.current_state = current_state
+        self.table = table
+
+    @property
+    def state_label(self):
+        return self.table.states[self.current_state]
+
+    def accepting(self):
+        return self.table.accept_flags[self.current_state]
+
+    def read_character(self, character):
+        self.current_state = self.table.next_state(self.current_state, character)
+
+    def read_string(self, string):
+        self.current_state = self.table.run(self.current_state, string)
+
 
 class NFARulebook:
     def __init__(self, rules):
@@ -104,6 +483,80 @@ class NFARulebook:
         return list(set([rule.character
                          for rule in self.rules if rule.character is not None]))
 
+    def indexed(self):
+        return IndexedNFARulebook(self.rules)
+
+
+# Rules are indexed by (state, character); rules labelled with a
+# CharacterRange are kept per state and checked against each character read.
+class IndexedNFARulebook(NFARulebook):
+    def __init__(self, rules):
+        super().__init__(rules)
+        self.index = {}
+        self.range_rules = {}
+        for rule in rules:
+            self.index.setdefault((rule.status, rule.character), []).append(rule)
+            if isinstance(rule.character, CharacterRange):
+                self.range_rules.setdefault(rule.status, []).append(rule)
+        self.closures = {}
+
+    def next_states(self, states: set, character):
+        next_states = set()
+        for rule in chain.from_iterable(self.rules_for(state, character) for state in states):
+            next_states.add(rule.follow())
+        return next_states
+
+    def rules_for(self, state, character):
+        rules = list(self.index.get((state, character), ()))
+        if self.range_rules and isinstance(character, str):
+            rules.extend(rule for rule in self.range_rules.get(state, ())
+                         if character in rule.character)
+        return rules
+
+    def closure(self, state):
+        closure = self.closures.get(state)
+        if closure is None:
+            closure = {state}
+            stack = [state]
+            while stack:
+                for rule in self.index.get((stack.pop(), None), ()):
+                    next_state = rule.follow()
+                    if next_state not in closure:
+                        closure.add(next_state)
+                        stack.append(next_state)
+            closure = frozenset(closure)
+            self.closures[state] = closure
+        return closure
+
+    def follow_free_moves(self, states: set):
+        if len(states) == 1:
+            return set(self.closure(next(iter(states))))
+        return set().union(*[self.closure(state) for state in states])
+
+
+# An NFARulebook over RuleColumns, for interned designs, reading next states
+# straight from the arrays; free moves are character id -1 like any other.
+class ColumnNFARulebook(NFARulebook):
+    def next_states(self, states: set, character):
+        next_status = self.rules.next_status
+        matching = self.rules.matching
+        return {next_status[i] for state in states for i in matching(state, character)}
+
+    def rules_for(self, state, character):
+        return [self.rules[i] for i in self.rules.matching(state, character)]
+
+    def follow_free_moves(self, states: set):
+        next_status = self.rules.next_status
+        matching = self.rules.matching
+        closure = set(states)
+        stack = list(states)
+        while stack:
+            for i in matching(stack.pop(), None):
+                if next_status[i] not in closure:
+                    closure.add(next_status[i])
+                    stack.append(next_status[i])
+        return closure
+
 
 class NFA:
     def __init__(self, current_states: set, accept_states: set, rulebook):
@@ -116,7 +569,8 @@ class NFA:
         return self.rulebook.follow_free_moves(self._current_states)
 
     def accepting(self):
-        return any(self.current_states & self.accept_states)
+        # not any(...): interned and Thompson designs number states from 0
+        return not self.current_states.isdisjoint(self.accept_states)
 
     def read_character(self, character):
         self._current_states = self.rulebook.next_states(self.current_states, character)
@@ -138,39 +592,239 @@ class NFADesign:
         return nfa.accepting()
 
     def to_nfa(self, start_state: set = None):
-        current_states = start_state or {self.start_state}
+        current_states = {self.start_state} if start_state is None else start_state
         return NFA(current_states, self.accept_states, self.rulebook)
 
+    # Like DFADesign.compile, CharacterRange labels go through a
+    # PartitionedDesign.
+    def compile(self):
+        if _ranged(self.rulebook.rules):
+            from the_simplest_computers.alphabet import PartitionedDesign
+            return PartitionedDesign.from_nfa_design(self).compile()
+        return BitNFADesign.from_nfa_design(self)
+
+    def interned(self):
+        columns = RuleColumns()
+        start_state = columns.state_id(self.start_state)
+        for rule in self.rulebook.rules:
+            columns.append(rule.status, rule.character, rule.next_status)
+        accept_states = {columns.state_id(state) for state in self.accept_states}
+        # an indexed rulebook stays indexed, now over state ids
+        if isinstance(self.rulebook, IndexedNFARulebook):
+            return NFADesign(start_state, accept_states, IndexedNFARulebook(columns))
+        return NFADesign(start_state, accept_states, ColumnNFARulebook(columns))
+
+
+# States are numbered 0..n-1 and a set of states is an int with bit i set for
+# state i. moves[character][i] is the free-move closed successor mask of state
+# i, and sources[character] masks the states that have a rule for character.
+class BitNFADesign:
+    def __init__(self, states, moves, sources, closure_masks, accept_mask):
+        self.states = states
+        self.moves = moves
+        self.sources = sources
+        self.closure_masks = closure_masks
+        self.start_mask = closure_masks[0]
+        self.accept_mask = accept_mask
+
+    def __repr__(self):
+        return f"BitNFADesign {len(self.states)} states x {len(self.moves)} symbols"
+
+    @classmethod
+    def from_nfa_design(cls, nfa_design):
+        rulebook = nfa_design.rulebook
+        _unranged(rulebook.rules, 'BitNFADesign')
+        if not isinstance(rulebook, IndexedNFARulebook):
+            rulebook = rulebook.indexed()
+
+        index = {}
+        states = []
+        for state in chain([nfa_design.start_state], nfa_design.accept_states,
+                           *[(rule.status, rule.next_status) for rule in rulebook.rules]):
+            if state not in index:
+                index[state] = len(states)
+                states.append(state)
+
+        closure_masks = [0] * len(states)
+        for state, i in index.items():
+            for closed_state in rulebook.closure(state):
+                closure_masks[i] |= 1 << index[closed_state]
+
+        moves = {}
+        sources = {}
+        for rule in rulebook.rules:
+            if rule.character is None:
+                continue
+            i = index[rule.status]
+            state_moves = moves.setdefault(rule.character, {})
+            state_moves[i] = state_moves.get(i, 0) | closure_masks[index[rule.next_status]]
+            sources[rule.character] = sources.get(rule.character, 0) | 1 << i
+
+        accept_mask = 0
+        for state in nfa_design.accept_states:
+            accept_mask |= 1 << index[state]
+        return cls(states, moves, sources, closure_masks, accept_mask)
+
+    def mask_for(self, states: set):
+        index = {state: i for i, state in enumerate(self.states)}
+        mask = 0
+        for state in states:
+            if state in index:
+                mask |= self.closure_masks[index[state]]
+        return mask
+
+    @staticmethod
+    def bits(mask):
+        while mask:
+            low = mask & -mask
+            yield low.bit_length() - 1
+            mask ^= low
+
+    def next_mask(self, mask, character):
+        state_moves = self.moves.get(character)
+        if state_moves is None:
+            return 0
+        mask &= self.sources[character]
+        next_mask = 0
+        while mask:
+            low = mask & -mask
+            next_mask |= state_moves[low.bit_length() - 1]
+            mask ^= low
+        return next_mask
+
+    def run(self, mask, string):
+        moves = self.moves
+        sources = self.sources
+        for character in string:
+            state_moves = moves.get(character)
+            if state_moves is None:
+                return 0
+            mask &= sources[character]
+            next_mask = 0
+            while mask:
+                low = mask & -mask
+                next_mask |= state_moves[low.bit_length() - 1]
+                mask ^= low
+            if not next_mask:
+                return 0
+            mask = next_mask
+        return mask
+
+    def to_nfa(self, start_state: set = None):
+        mask = self.start_mask if start_state is None else self.mask_for(start_state)
+        return BitNFA(mask, self)
+
+    def accepts(self, string):
+        return bool(self.run(self.start_mask, string) & self.accept_mask)
+
+
+class BitNFA:
+    def __init__(self, current_mask, design):
+        self.current_mask = current_mask
+        self.design = design
+
+    @property
+    def current_states(self):
+        return {self.design.states[i] for i in self.design.bits(self.current_mask)}
+
+    def accepting(self):
+        return bool(self.current_mask & self.design.accept_mask)
+
+    def read_character(self, character):
+        self.current_mask = self.design.next_mask(self.current_mask, character)
+
+    def read_string(self, string):
+        self.current_mask = self.design.run(self.current_mask, string)
 
+
+class StateLimitExceeded(Exception):
+    pass
+
+
+class DeterminizationStats:
+    def __init__(self):
+        self.states_discovered = 0
+        self.states_expanded = 0
+        self.transitions_created = 0
+        self.elapsed = 0.0
+
+    def __repr__(self):
+        return (f"DeterminizationStats states={self.states_discovered} "
+                f"expanded={self.states_expanded} transitions={self.transitions_created} "
+                f"elapsed={self.elapsed:.6f}s")
+
+
+# A design with CharacterRange labels is simulated over its alphabet
+# classes: characters passed to next_state are looked up in the partition,
+# and to_dfa_design returns a PartitionedDesign.
 class NFASimulation:
-    def __init__(self, nfa_design):
+    def __init__(self, nfa_design, max_states=None, progress=None):
+        self.partition = None
+        if _ranged(nfa_design.rulebook.rules):
+            from the_simplest_computers.alphabet import PartitionedDesign
+            partitioned = PartitionedDesign.from_nfa_design(nfa_design)
+            self.partition, nfa_design = partitioned.partition, partitioned.design
         self.nfa_design = nfa_design
+        self.max_states = max_states
+        self.progress = progress
+        self.stats = DeterminizationStats()
+        rulebook = nfa_design.rulebook
+        self.rulebook = rulebook if isinstance(rulebook, IndexedNFARulebook) else rulebook.indexed()
 
     def next_state(self, state: set, character):
-        nfa = self.nfa_design.to_nfa(state)
-        nfa.read_character(character)
-        return nfa.current_states
+        if self.partition is not None and isinstance(character, str):
+            character = self.partition.class_of(character)
+        rulebook = self.rulebook
+        return rulebook.follow_free_moves(
+            rulebook.next_states(rulebook.follow_free_moves(state), character))
 
     def rules_for(self, state):
         return [FARule(state, character, self.next_state(state, character))
-                for character in self.nfa_design.rulebook.alphabet()]
+                for character in self.rulebook.alphabet()]
 
     def discover_states_and_rules(self, states: List[set]):
-        rules = list(set(chain(*[self.rules_for(state) for state in states])))
-        more_states = [rule.follow() for rule in rules if rule.follow() not in states]
-        more_states_issubset_states = all([state in states for state in more_states])
-
-        if more_states_issubset_states:
-            return states, rules
-        else:
-            return self.discover_states_and_rules(states + more_states)
+        # Worklist subset construction: each subset is expanded exactly once
+        # and known subsets are looked up by frozenset.
+        stats = self.stats = DeterminizationStats()
+        started = time.perf_counter()
+        known = {frozenset(state): state for state in states}
+        worklist = deque(states)
+        rules = []
+        stats.states_discovered = len(known)
+
+        while worklist:
+            for rule in self.rules_for(worklist.popleft()):
+                rules.append(rule)
+                next_state = rule.follow()
+                key = frozenset(next_state)
+                if key not in known:
+                    if self.max_states is not None and len(known) >= self.max_states:
+                        stats.elapsed = time.perf_counter() - started
+                        raise StateLimitExceeded(
+                            f"subset construction exceeded {self.max_states} states")
+                    known[key] = next_state
+                    worklist.append(next_state)
+
+            stats.states_discovered = len(known)
+            stats.states_expanded += 1
+            stats.transitions_created = len(rules)
+            stats.elapsed = time.perf_counter() - started
+            if self.progress is not None:
+                self.progress(stats)
+
+        return list(known.values()), rules
 
     def to_dfa_design(self):
-        start_state = self.nfa_design.to_nfa().current_states
+        start_state = self.rulebook.follow_free_moves({self.nfa_design.start_state})
         states, rules = self.discover_states_and_rules([start_state])
-        accept_states = [state for state in states if self.nfa_design.to_nfa(state).accepting()]
+        accept_states = [state for state in states
+                         if not state.isdisjoint(self.nfa_design.accept_states)]
 
-        return DFADesign(start_state, accept_states, DFARulebook(rules))
+        dfa_design = DFADesign(start_state, accept_states, DFARulebook(rules))
+        if self.partition is not None:
+            from the_simplest_computers.alphabet import PartitionedDesign
+            return PartitionedDesign(self.partition, dfa_design)
+        return dfa_design
 
 
 if __name__ == '__main__':
@@ -210,6 +864,22 @@ if __name__ == '__main__':
           dfa_design.accepts('baa'),
           dfa_design.accepts('baba'))
 
+    # dfa table
+    dfa_table = dfa_design.compile()
+    print(dfa_table,
+          dfa_table.accepts('a'),
+          dfa_table.accepts('baa'),
+          dfa_table.accepts('baba'),
+          dfa_table.accepts('bac'))
+
+    # product
+    ends_with_a_design = DFADesign(1, [2], DFARulebook(
+        [FARule(1, 'a', 2), FARule(1, 'b', 1), FARule(2, 'a', 2), FARule(2, 'b', 1)]))
+    for product_design in [dfa_design.intersection(ends_with_a_design),
+                           dfa_design.difference(ends_with_a_design),
+                           dfa_design.union(ends_with_a_design)]:
+        print([product_design.accepts(string) for string in ['a', 'ab', 'aba', 'bab']])
+
     # nfa
     nfa_rules = [FARule(1, 'a', 1), FARule(1, 'b', 1), FARule(1, 'b', 2),
                  FARule(2, 'a', 3), FARule(2, 'b', 3),
@@ -261,6 +931,72 @@ if __name__ == '__main__':
           nfa_design.accepts('aaaaa'),
           nfa_design.accepts('aaaaaa'))
 
+    # indexed rulebook
+    indexed_nfa_design = NFADesign(1, {2, 4}, nfa_free_move_rulebook.indexed())
+    print(indexed_nfa_design.rulebook.follow_free_moves({1}),
+          indexed_nfa_design.accepts('aa'),
+          indexed_nfa_design.accepts('aaa'),
+          indexed_nfa_design.accepts('aaaaa'),
+          indexed_nfa_design.accepts('aaaaaa'))
+
+    chain_rulebook = NFARulebook([FARule(i, None, i + 1) for i in range(5000)]).indexed()
+    print(len(chain_rulebook.follow_free_moves({0})))
+
+    # bit nfa
+    bit_nfa_design = NFADesign(1, {2, 4}, nfa_free_move_rulebook).compile()
+    print(bit_nfa_design,
+          bit_nfa_design.to_nfa().current_states,
+          bit_nfa_design.accepts('aa'),
+          bit_nfa_design.accepts('aaa'),
+          bit_nfa_design.accepts('aaaaa'),
+          bit_nfa_design.accepts('aaaaaa'))
+
+    bit_nfa = NFADesign(1, {4}, nfa_rulebook).compile().to_nfa()
+    bit_nfa.read_string('bab')
+    print(bit_nfa.current_states, bit_nfa.accepting())
+
+    # interned
+    interned_nfa_design = NFADesign(1, {2, 4}, nfa_free_move_rulebook).interned()
+    print(interned_nfa_design.rulebook.rules,
+          interned_nfa_design.rulebook.rules.labelled(0),
+          interned_nfa_design.accepts('aa'),
+          interned_nfa_design.accepts('aaa'),
+          interned_nfa_design.accepts('aaaaa'),
+          interned_nfa_design.accepts('aaaaaa'))
+    # interning renumbers the start state as 0, which must still accept
+    cycle_nfa_design = NFADesign(1, {1}, NFARulebook([FARule(1, 'a', 2), FARule(2, 'a', 1)]))
+    print(cycle_nfa_design.interned().accepts(''),
+          cycle_nfa_design.interned().accepts('aa'),
+          cycle_nfa_design.interned().accepts('a'))
+    print(len({FARule({1, 2}, 'a', {2, 1}), FARule({2, 1}, 'a', {1, 2}), FARule(1, 'a', 2)}))
+
+    import tracemalloc
+    tracemalloc.start()
+    rule_list = [FARule(i, 'ab'[i % 2], i + 1) for i in range(100000)]
+    list_bytes = tracemalloc.get_traced_memory()[0]
+    rule_columns = RuleColumns(rule_list)
+    columns_bytes = tracemalloc.get_traced_memory()[0] - list_bytes
+    tracemalloc.stop()
+    column_bytes = sum(column.itemsize * len(column) for column in
+                       [rule_columns.status, rule_columns.character, rule_columns.next_status])
+    print(rule_columns, f"list {list_bytes // len(rule_list)} bytes/rule,",
+          f"columns {column_bytes // len(rule_columns)} bytes/rule",
+          f"+ labels {(columns_bytes - column_bytes) // len(rule_columns.labels)} bytes/state")
+
+    # interned designs scan only the current state's rules, comparing ids
+    speed_rules = [FARule(i, character, (i * 7 + ord(character)) % 200)
+                   for i in range(200) for character in 'abcd']
+    speed_strings = ['abcd'[i % 4] * 3 + 'dcba'[i % 3] * 5 for i in range(200)] * 5
+    for speed_design in [DFADesign(0, list(range(0, 200, 3)), DFARulebook(speed_rules)),
+                         NFADesign(0, set(range(0, 200, 3)), NFARulebook(speed_rules))]:
+        timings = []
+        for design in [speed_design, speed_design.interned()]:
+            started = time.perf_counter()
+            answers = [design.accepts(string) for string in speed_strings]
+            timings.append(time.perf_counter() - started)
+        print(type(speed_design).__name__, f"interned {timings[0] / timings[1]:.1f}x faster",
+              answers == [speed_design.accepts(string) for string in speed_strings])
+
     # NFASimulation
     simulation_rules = [FARule(1, 'a', 1), FARule(1, 'a', 2), FARule(1, None, 2),
                         FARule(2, 'b', 3),
@@ -296,4 +1032,41 @@ if __name__ == '__main__':
     dfa_design = simulation.to_dfa_design()
     print(dfa_design.accepts('aaa'),
           dfa_design.accepts('aab'),
-          dfa_design.accepts('bbbabb'))
+          dfa_design.accepts('bbbabb'),
+          dfa_design.accepts('baab'))
+    print(simulation.stats)
+
+    try:
+        NFASimulation(simulation_nfa_design, max_states=2).to_dfa_design()
+    except StateLimitExceeded as error:
+        print(error)
+
+    dfa_table = dfa_design.compile()
+    print(dfa_table,
+          dfa_table.accepts('aaa'),
+          dfa_table.accepts('aab'),
+          dfa_table.accepts('bbbabb'))
+
+    # minimize
+    redundant_dfa_design = DFADesign(1, [3, 4], DFARulebook(
+        [FARule(1, 'a', 2), FARule(1, 'b', 1),
+         FARule(2, 'a', 2), FARule(2, 'b', 3),
+         FARule(3, 'a', 4), FARule(3, 'b', 3),
+         FARule(4, 'a', 3), FARule(4, 'b', 4)]))
+    print(redundant_dfa_design.minimize().rulebook)
+    minimal_dfa_design = dfa_design.minimize()
+    print(minimal_dfa_design.rulebook,
+          minimal_dfa_design.accept_states,
+          minimal_dfa_design.accepts('aaa'),
+          minimal_dfa_design.accepts('aab'),
+          minimal_dfa_design.accepts('bbbabb'),
+          minimal_dfa_design.accepts('baab'))
+
+    # a chain splits one state off at a time; each split costs only its
+    # smaller half, so doubling the chain roughly doubles the time
+    for length in [16000, 32000]:
+        chain_table = DFADesign(0, [length - 1], DFARulebook(
+            [FARule(i, 'a', i + 1) for i in range(length - 1)])).compile()
+        started = time.perf_counter()
+        chain_length = len(chain_table.minimize().rulebook.rules)
+        print(length, chain_length, f"{time.perf_counter() - started:.3f}s")
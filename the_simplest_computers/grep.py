@@ -0,0 +1,212 @@
+import argparse
+import mmap
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from the_simplest_computers.regular_expressions import PatternError, compile
+
+# Files are read as bytes, each byte standing for the character with the same
+# code point, like Searcher does. The pattern is compiled once in the parent;
+# workers get the compiled Searcher when they start, inherited for free when
+# processes are forked and pickled once per worker otherwise. Each worker maps
+# the file itself, so only (path, start, end) chunk descriptions and the
+# matching lines cross between processes.
+CHUNK_SIZE = 8 << 20
+
+_searcher = None
+_mapped = {}
+
+
+def _initialize(searcher):
+    global _searcher
+    _searcher = searcher
+
+
+def _mapping(path):
+    mapped = _mapped.get(path)
+    if mapped is None:
+        for old in _mapped.values():
+            old.close()
+        _mapped.clear()
+        with open(path, 'rb') as file:
+            mapped = _mapped[path] = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    return mapped
+
+
+# Yields (start, end) for each line of text[start:end] with a match in it,
+# end excluding the newline. When every match contains some literal, only
+# the lines holding it are searched. Otherwise the search runs over the rest
+# of the chunk, and a match found across a newline only counts if its first
+# line has one of its own.
+def matching_lines(searcher, text, start, end):
+    literal = max(searcher.prefix, searcher.required, key=len)
+    needle = searcher.needle(literal, text) if '\n' not in literal else None
+    position = start
+    while position < end:
+        if needle is not None:
+            found = text.find(needle, position, end)
+            if found < 0:
+                return
+            match = None
+        else:
+            match = searcher.search(text, position, end)
+            if match is None:
+                return
+            found = match.start
+        line_start = max(position, text.rfind(b'\n', position, found) + 1)
+        line_end = text.find(b'\n', found, end)
+        if line_end < 0:
+            line_end = end
+        if (match is not None and match.end <= line_end
+                or searcher.search(text, line_start, line_end)):
+            yield line_start, line_end
+        position = line_end + 1
+
+
+# Runs in a worker: the matching lines of one chunk with their line numbers
+# counted from the chunk's start, and the number of lines in the chunk, when
+# numbered is set.
+def scan_chunk(path, start, end, numbered=False):
+    text = _mapping(path)
+    lines = []
+    line_number = 0
+    counted = start
+    for line_start, line_end in matching_lines(_searcher, text, start, end):
+        if numbered:
+            line_number += text[counted:line_start].count(b'\n')
+            counted = line_start
+        lines.append((line_number, text[line_start:line_end]))
+    line_count = text[start:end].count(b'\n') if numbered else 0
+    return lines, line_count
+
+
+# Splits a file into chunks of about chunk_size bytes that end just after a
+# newline, or at the end of the file.
+def chunks(path, chunk_size=CHUNK_SIZE):
+    size = os.path.getsize(path)
+    if size == 0:
+        return
+    with open(path, 'rb') as file, \
+            mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        start = 0
+        while start < size:
+            end = mapped.find(b'\n', min(start + chunk_size, size) - 1)
+            end = size if end < 0 else end + 1
+            yield start, end
+            start = end
+
+
+def paths(names):
+    for name in names:
+        if os.path.isdir(name):
+            for directory, subdirectories, files in os.walk(name):
+                subdirectories.sort()
+                for file in sorted(files):
+                    yield os.path.join(directory, file)
+        else:
+            yield name
+
+
+def tasks(names, chunk_size, errors):
+    for path in paths(names):
+        try:
+            for start, end in chunks(path, chunk_size):
+                yield path, start, end
+        except OSError as error:
+            errors.append(f"{path}: {error.strerror}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m the_simplest_computers.grep',
+        description='Print the lines of files (or of files under directories) that '
+                    'contain a match for a pattern.')
+    parser.add_argument('pattern')
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('-n', '--line-number', action='store_true',
+                        help='prefix each line with its line number')
+    parser.add_argument('-c', '--count', action='store_true',
+                        help='print only the number of matching lines per file')
+    parser.add_argument('-H', '--with-filename', action='store_true',
+                        help='prefix each line with its file name')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='worker processes (default: one per CPU; 1 scans in-process)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help='bytes per chunk handed to a worker')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='do not report throughput on stderr')
+    args = parser.parse_args(argv)
+
+    try:
+        searcher = compile(args.pattern).compiled_searcher()
+    except PatternError as error:
+        print(f"grep: {error}", file=sys.stderr)
+        return 2
+
+    with_filename = args.with_filename or len(args.files) > 1 or any(
+        os.path.isdir(name) for name in args.files)
+    output = sys.stdout.buffer
+    errors = []
+    counts = {}
+    line_offsets = {}
+    scanned = matched = 0
+    started = time.perf_counter()
+
+    def emit(path, start, end, lines, line_count):
+        nonlocal scanned, matched
+        scanned += end - start
+        matched += len(lines)
+        offset = line_offsets.get(path, 0)
+        line_offsets[path] = offset + line_count
+        if args.count:
+            counts[path] = counts.get(path, 0) + len(lines)
+            return
+        prefix = f"{path}:".encode() if with_filename else b''
+        for line_number, line in lines:
+            number = f"{offset + line_number + 1}:".encode() if args.line_number else b''
+            output.write(prefix + number + line + b'\n')
+
+    work = tasks(args.files, args.chunk_size, errors)
+    if args.jobs <= 1:
+        _initialize(searcher)
+        for path, start, end in work:
+            emit(path, start, end, *scan_chunk(path, start, end, args.line_number))
+    else:
+        # a bounded window of chunks in flight keeps the output in order
+        # without holding every result in memory
+        with ProcessPoolExecutor(args.jobs, initializer=_initialize,
+                                 initargs=(searcher,)) as executor:
+            pending = deque()
+            for path, start, end in work:
+                pending.append((path, start, end,
+                                executor.submit(scan_chunk, path, start, end, args.line_number)))
+                if len(pending) >= 4 * args.jobs:
+                    path, start, end, future = pending.popleft()
+                    emit(path, start, end, *future.result())
+            while pending:
+                path, start, end, future = pending.popleft()
+                emit(path, start, end, *future.result())
+
+    if args.count:
+        for path in paths(args.files):
+            prefix = f"{path}:".encode() if with_filename else b''
+            output.write(prefix + f"{counts.get(path, 0)}\n".encode())
+    output.flush()
+
+    for error in errors:
+        print(f"grep: {error}", file=sys.stderr)
+    elapsed = time.perf_counter() - started
+    if not args.quiet:
+        print(f"grep: {scanned / 1e6:.1f} MB in {elapsed:.3f}s, "
+              f"{scanned / 1e6 / elapsed if elapsed else 0:.1f} MB/s, "
+              f"{matched} matching lines, {max(args.jobs, 1)} jobs", file=sys.stderr)
+    if errors:
+        return 2
+    return 0 if matched else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
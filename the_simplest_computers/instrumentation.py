@@ -0,0 +1,155 @@
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from the_simplest_computers.derivatives import DerivativeDesign
+from the_simplest_computers.finite_automata import (DFARulebook, IndexedNFARulebook, NFARulebook,
+                                                    NFASimulation)
+
+
+class AutomataStats:
+    def __init__(self):
+        self.calls = Counter()
+        self.seconds = Counter()
+        self.counts = Counter()
+
+    def __repr__(self):
+        calls = ', '.join(f"{name}={self.calls[name]} ({self.seconds[name]:.6f}s)"
+                          for name in sorted(self.calls))
+        counts = ', '.join(f"{name}={value}" for name, value in sorted(self.counts.items()))
+        return f"AutomataStats calls: {calls}; counts: {counts}"
+
+    def as_dict(self):
+        return {'calls': dict(self.calls), 'seconds': dict(self.seconds), 'counts': dict(self.counts)}
+
+
+def _count_next_states(stats, rulebook, args, result):
+    states = args[0]
+    stats.counts['transitions'] += len(result)
+    if isinstance(rulebook, IndexedNFARulebook):
+        stats.counts['index_lookups'] += len(states)
+    else:
+        stats.counts['rule_scans'] += len(states) * len(rulebook.rules)
+
+
+def _count_follow_free_moves(stats, rulebook, args, result):
+    stats.counts['closure_evaluations'] += 1
+
+
+def _count_rule_for(stats, rulebook, args, result):
+    for scanned, rule in enumerate(rulebook.rules, 1):
+        if rule is result:
+            break
+    else:
+        scanned = len(rulebook.rules)
+    stats.counts['rule_scans'] += scanned
+    stats.counts['transitions'] += 1
+
+
+def _count_discover_states_and_rules(stats, simulation, args, result):
+    states, rules = result
+    stats.counts['states_discovered'] += len(states)
+    stats.counts['rules_created'] += len(rules)
+
+
+def _count_derivative(stats, design, args, result):
+    stats.counts['derivatives'] += 1
+    stats.counts['derivative_terms'] = len(design.kinds)
+    stats.counts['derivative_cache_size'] = len(design.cache)
+
+
+HOOKS = [
+    (NFARulebook, 'next_states', _count_next_states),
+    (NFARulebook, 'follow_free_moves', _count_follow_free_moves),
+    (IndexedNFARulebook, 'next_states', _count_next_states),
+    (IndexedNFARulebook, 'follow_free_moves', _count_follow_free_moves),
+    (DFARulebook, 'rule_for', _count_rule_for),
+    (NFASimulation, 'discover_states_and_rules', _count_discover_states_and_rules),
+    (DerivativeDesign, 'derivative', _count_derivative),
+]
+
+
+def _wrap(stats, callback, name, function, count):
+    # Times are inclusive and only taken for the outermost call, so recursion
+    # (follow_free_moves calling itself) is not counted twice.
+    depth = 0
+
+    def wrapper(self, *args):
+        nonlocal depth
+        outermost = depth == 0
+        depth += 1
+        started = time.perf_counter()
+        try:
+            result = function(self, *args)
+        finally:
+            depth -= 1
+        stats.calls[name] += 1
+        count(stats, self, args, result)
+        if outermost:
+            elapsed = time.perf_counter() - started
+            stats.seconds[name] += elapsed
+            if callback is not None:
+                callback(name, elapsed, stats)
+        return result
+
+    wrapper.__wrapped__ = function
+    return wrapper
+
+
+_installed = False
+
+
+# The hooks replace the hot methods on their classes only while the context
+# is active; outside of it the original methods run untouched.
+@contextmanager
+def instrumented(stats=None, callback=None):
+    global _installed
+    if _installed:
+        raise RuntimeError('automata instrumentation is already active')
+
+    stats = AutomataStats() if stats is None else stats
+    originals = []
+    for cls, method, count in HOOKS:
+        function = cls.__dict__[method]
+        originals.append((cls, method, function))
+        setattr(cls, method, _wrap(stats, callback, f"{cls.__name__}.{method}", function, count))
+    _installed = True
+    try:
+        yield stats
+    finally:
+        for cls, method, function in originals:
+            setattr(cls, method, function)
+        _installed = False
+
+
+if __name__ == '__main__':
+    from the_simplest_computers.finite_automata import DFADesign, FARule, NFADesign
+    from the_simplest_computers.regular_expressions import Choose, Concatenate, Literal, Repeat
+
+    rules = [FARule(1, 'a', 2), FARule(1, 'b', 1),
+             FARule(2, 'a', 2), FARule(2, 'b', 3),
+             FARule(3, 'a', 3), FARule(3, 'b', 3)]
+    with instrumented() as stats:
+        DFADesign(1, [3], DFARulebook(rules)).accepts('baaab')
+    print(stats)
+
+    simulation_rules = [FARule(1, 'a', 1), FARule(1, 'a', 2), FARule(1, None, 2),
+                        FARule(2, 'b', 3),
+                        FARule(3, 'b', 1), FARule(3, None, 2)]
+    nfa_design = NFADesign(1, {3}, NFARulebook(simulation_rules))
+
+    events = []
+    with instrumented(callback=lambda name, elapsed, stats: events.append(name)) as stats:
+        nfa_design.accepts('aabbb')
+        NFASimulation(nfa_design).to_dfa_design()
+    print(stats)
+    print(stats.as_dict()['counts'], len(events))
+
+    with instrumented() as stats:
+        design = DerivativeDesign(Repeat(Choose(Literal('a'), Concatenate(Literal('a'),
+                                                                          Literal('b')))))
+        design.accepts('aabab')
+    print(stats.as_dict()['counts'], design.stats)
+
+    # back to the original methods
+    print(NFARulebook.next_states.__qualname__, hasattr(NFARulebook.next_states, '__wrapped__'))
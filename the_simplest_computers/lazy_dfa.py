@@ -0,0 +1,188 @@
+import sys
+from collections import OrderedDict
+
+from the_simplest_computers.alphabet import PartitionedDesign
+from the_simplest_computers.finite_automata import NFADesign
+
+# Rough size of a cache entry besides the masks themselves: the key tuple, the
+# character and the dict slot.
+ENTRY_OVERHEAD = 120
+
+
+class LazyDFAStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.flushes = 0
+        self.fallbacks = 0
+
+    def __repr__(self):
+        return (f"LazyDFAStats hits={self.hits} misses={self.misses} "
+                f"hit_rate={self.hit_rate:.3f} evictions={self.evictions} "
+                f"flushes={self.flushes} fallbacks={self.fallbacks}")
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+# Builds DFA states (bitmasks of NFA states) only as the input reaches them and
+# memoizes (mask, character) -> mask transitions. When the cache outgrows
+# memory_limit it either evicts the least recently used transitions ('lru') or
+# starts over ('flush'). If a string keeps missing the cache for a whole
+# thrash_window it finishes on plain bitmask NFA stepping instead.
+# A design with CharacterRange labels is run over its alphabet classes, each
+# character being looked up in the partition before the cache.
+class LazyDFADesign:
+    def __init__(self, nfa_design, memory_limit=1 << 20, policy='lru',
+                 thrash_window=1024, thrash_ratio=0.5):
+        if policy not in ('lru', 'flush'):
+            raise ValueError(f"unknown cache policy {policy!r}")
+        if isinstance(nfa_design, NFADesign):
+            nfa_design = nfa_design.compile()
+        self.partition = None
+        if isinstance(nfa_design, PartitionedDesign):
+            self.partition, nfa_design = nfa_design.partition, nfa_design.compile().design
+        self.design = nfa_design
+        self.memory_limit = memory_limit
+        self.policy = policy
+        self.thrash_window = thrash_window
+        self.thrash_ratio = thrash_ratio
+        self.cache = OrderedDict()
+        self.memory = 0
+        self.stats = LazyDFAStats()
+
+    def __repr__(self):
+        return f"LazyDFADesign {len(self.cache)} transitions, {self.memory} bytes"
+
+    @staticmethod
+    def entry_cost(key, next_mask):
+        return ENTRY_OVERHEAD + sys.getsizeof(key[0]) + sys.getsizeof(next_mask)
+
+    def store(self, key, next_mask):
+        cost = self.entry_cost(key, next_mask)
+        if self.memory + cost > self.memory_limit:
+            if self.policy == 'flush':
+                self.cache.clear()
+                self.memory = 0
+                self.stats.flushes += 1
+            else:
+                while self.cache and self.memory + cost > self.memory_limit:
+                    old_key, old_mask = self.cache.popitem(last=False)
+                    self.memory -= self.entry_cost(old_key, old_mask)
+                    self.stats.evictions += 1
+        self.cache[key] = next_mask
+        self.memory += cost
+
+    def next_mask(self, mask, character):
+        if self.partition is not None:
+            character = self.partition.class_of(character)
+        key = (mask, character)
+        next_mask = self.cache.get(key)
+        if next_mask is None:
+            self.stats.misses += 1
+            next_mask = self.design.next_mask(mask, character)
+            self.store(key, next_mask)
+        else:
+            self.stats.hits += 1
+            if self.policy == 'lru':
+                self.cache.move_to_end(key)
+        return next_mask
+
+    def run(self, mask, string):
+        cache = self.cache
+        stats = self.stats
+        lru = self.policy == 'lru'
+        window = self.thrash_window
+        window_misses = 0
+        # one iterator throughout, so the fallback picks up where the loop
+        # stopped, whether string is a sequence or a consumed iterator
+        characters = iter(string)
+        if self.partition is not None:
+            characters = map(self.partition.class_of, characters)
+        for position, character in enumerate(characters, 1):
+            key = (mask, character)
+            next_mask = cache.get(key)
+            if next_mask is None:
+                stats.misses += 1
+                window_misses += 1
+                next_mask = self.design.next_mask(mask, character)
+                self.store(key, next_mask)
+            else:
+                stats.hits += 1
+                if lru:
+                    cache.move_to_end(key)
+            mask = next_mask
+            if not mask:
+                return 0
+            if position % window == 0:
+                if window_misses > window * self.thrash_ratio:
+                    stats.fallbacks += 1
+                    return self.design.run(mask, characters)
+                window_misses = 0
+        return mask
+
+    def to_dfa(self):
+        return LazyDFA(self.design.start_mask, self)
+
+    def accepts(self, string):
+        return bool(self.run(self.design.start_mask, string) & self.design.accept_mask)
+
+
+class LazyDFA:
+    def __init__(self, current_mask, design):
+        self.current_mask = current_mask
+        self.design = design
+
+    @property
+    def current_states(self):
+        return {self.design.design.states[i] for i in self.design.design.bits(self.current_mask)}
+
+    def accepting(self):
+        return bool(self.current_mask & self.design.design.accept_mask)
+
+    def read_character(self, character):
+        self.current_mask = self.design.next_mask(self.current_mask, character)
+
+    def read_string(self, string):
+        self.current_mask = self.design.run(self.current_mask, string)
+
+
+if __name__ == '__main__':
+    import random
+
+    from the_simplest_computers.regular_expressions import Choose, Concatenate, Literal, Repeat
+
+    # (a|b)*a(a|b)(a|b)(a|b)(a|b)(a|b) has 2^6 DFA states after determinization
+    a_or_b = Choose(Literal('a'), Literal('b'))
+    pattern = Concatenate(Repeat(a_or_b), Literal('a'))
+    for _ in range(5):
+        pattern = Concatenate(pattern, a_or_b)
+    nfa_design = pattern.to_nfa_design()
+
+    lazy_dfa_design = LazyDFADesign(nfa_design)
+    print(lazy_dfa_design.accepts('abbbbb'),
+          lazy_dfa_design.accepts('babbbbb'),
+          lazy_dfa_design.accepts('bbbbbb'))
+
+    lazy_dfa = lazy_dfa_design.to_dfa()
+    lazy_dfa.read_string('bbab')
+    print(lazy_dfa.accepting(), len(lazy_dfa.current_states))
+
+    random.seed(0)
+    strings = [''.join(random.choice('ab') for _ in range(200)) for _ in range(200)]
+    expected = [nfa_design.compile().accepts(string) for string in strings]
+    for design in [LazyDFADesign(nfa_design),
+                   LazyDFADesign(nfa_design, memory_limit=4096),
+                   LazyDFADesign(nfa_design, memory_limit=4096, policy='flush'),
+                   LazyDFADesign(nfa_design, memory_limit=1024, thrash_window=64)]:
+        assert [design.accepts(string) for string in strings] == expected
+        print(design, design.stats)
+
+    # falling back mid-string carries on from the same position, also for
+    # input read from an iterator
+    design = LazyDFADesign(nfa_design, memory_limit=1024, thrash_window=64)
+    assert [design.accepts(iter(string)) for string in strings] == expected
+    print(design.stats.fallbacks > 0)
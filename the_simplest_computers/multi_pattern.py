@@ -0,0 +1,83 @@
+from the_simplest_computers.alphabet import PartitionedDesign
+from the_simplest_computers.finite_automata import FARule, NFADesign, NFARulebook
+from the_simplest_computers.lazy_dfa import LazyDFADesign
+
+
+# The union reads alphabet classes rather than characters, so patterns with
+# character classes share one partition, and run looks each character up in
+# it before the lazy DFA.
+class PatternSet:
+    def __init__(self, patterns, memory_limit=1 << 22):
+        self.patterns = list(patterns)
+        self.nfa_design, self.accept_states = self.union([
+            pattern if isinstance(pattern, NFADesign) else pattern.to_nfa_design()
+            for pattern in self.patterns])
+        partitioned = PartitionedDesign.from_nfa_design(self.nfa_design)
+        self.partition = partitioned.partition
+        self.lazy_dfa_design = LazyDFADesign(partitioned.design, memory_limit=memory_limit)
+
+        design = self.lazy_dfa_design.design
+        index = {state: i for i, state in enumerate(design.states)}
+        self.accept_masks = []
+        for accept_states in self.accept_states:
+            mask = 0
+            for state in accept_states:
+                mask |= 1 << index[state]
+            self.accept_masks.append(mask)
+
+    def __repr__(self):
+        return f"PatternSet {self.patterns}"
+
+    def __len__(self):
+        return len(self.patterns)
+
+    @staticmethod
+    def union(nfa_designs):
+        # States are tagged with their pattern's index so that designs
+        # numbering their states the same way cannot collide, and a fresh
+        # start state has a free move into every pattern.
+        start_state = ('start',)
+        rules = [FARule(start_state, None, (i, nfa_design.start_state))
+                 for i, nfa_design in enumerate(nfa_designs)]
+        accept_states = []
+        for i, nfa_design in enumerate(nfa_designs):
+            rules.extend(FARule((i, rule.status), rule.character, (i, rule.next_status))
+                         for rule in nfa_design.rulebook.rules)
+            accept_states.append({(i, state) for state in nfa_design.accept_states})
+
+        nfa_design = NFADesign(start_state, set().union(*accept_states), NFARulebook(rules))
+        return nfa_design, accept_states
+
+    def run(self, string):
+        design = self.lazy_dfa_design
+        return design.run(design.design.start_mask, map(self.partition.class_of, string))
+
+    def matches(self, string):
+        mask = self.run(string)
+        return [i for i, accept_mask in enumerate(self.accept_masks) if mask & accept_mask]
+
+    def matches_any(self, string):
+        return bool(self.run(string) & self.lazy_dfa_design.design.accept_mask)
+
+
+if __name__ == '__main__':
+    from the_simplest_computers.regular_expressions import Choose, Concatenate, Literal, Repeat, parse
+
+    patterns = [Repeat(Literal('a')),
+                Concatenate(Literal('a'), Literal('b')),
+                Repeat(Choose(Literal('a'), Literal('b'))),
+                Concatenate(Repeat(Literal('b')), Literal('a'))]
+    pattern_set = PatternSet(patterns)
+    print(pattern_set)
+    for string in ['', 'a', 'ab', 'bba', 'abc']:
+        print(repr(string), pattern_set.matches(string),
+              [i for i, pattern in enumerate(patterns) if pattern.matches(string)])
+    print(pattern_set.matches_any('abc'), pattern_set.lazy_dfa_design.stats)
+
+    # character classes share the union's alphabet partition
+    patterns = [parse('[a-c]'), parse('x'), parse('[^a]y*'), parse('[b-z]+')]
+    pattern_set = PatternSet(patterns)
+    print(pattern_set.partition)
+    for string in ['b', 'x', 'a', 'cyy', 'by', '']:
+        print(repr(string), pattern_set.matches(string),
+              [i for i, pattern in enumerate(patterns) if pattern.matches(string)])
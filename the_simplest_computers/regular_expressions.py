@@ -1,4 +1,10 @@
-from the_simplest_computers.finite_automata import NFARulebook, NFADesign, FARule
+import threading
+from collections import OrderedDict
+
+from the_simplest_computers.alphabet import CharacterRange, PartitionedDesign
+from the_simplest_computers.finite_automata import (NFARulebook, NFADesign, FARule, NFASimulation,
+                                                    StateLimitExceeded)
+from the_simplest_computers.search import PikeVM, Searcher
 
 
 class State:
@@ -13,7 +19,21 @@ class Pattern:
     precedence = None
 
     def to_nfa_design(self):
-        raise NotImplemented
+        # nodes without a construction of their own reuse the Thompson one,
+        # with fresh states so they combine with the recursive designs
+        compiler = ThompsonCompiler()
+        nfa_design = compiler.to_nfa_design(self)
+        states = [State(f"thompson_{i}") for i in range(compiler.state_count)]
+        rules = [FARule(states[rule.status], rule.character, states[rule.next_status])
+                 for rule in nfa_design.rulebook.rules]
+        return NFADesign(states[nfa_design.start_state],
+                         {states[state] for state in nfa_design.accept_states}, NFARulebook(rules))
+
+    def children(self):
+        return ()
+
+    def thompson(self, compiler, fragments):
+        raise NotImplementedError
 
     def bracket(self, out_precedence):
         if self.precedence < out_precedence:
@@ -21,8 +41,42 @@ class Pattern:
         else:
             return f"{self}"
 
+    # A tree holding a node that has no NFA, like the Intersect and
+    # Complement of derivatives, is matched by the derivative design that
+    # node's class builds for the whole tree, and cannot be compiled.
+    derivative_only = False
+
+    def derivative_node(self):
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node.derivative_only:
+                return node
+            stack.extend(node.children())
+        return None
+
     def matches(self, string):
-        return self.to_nfa_design().accepts(string)
+        compiled = self.__dict__.get('compiled')
+        if compiled is not None:
+            return compiled.fullmatch(string)
+        design = self.__dict__.get('design')
+        if design is None:
+            node = self.derivative_node()
+            if node is None:
+                return self.compile().fullmatch(string)
+            design = self.__dict__.setdefault('design', node.derivative_design(self))
+        return design.accepts(string)
+
+    def compile(self):
+        compiled = self.__dict__.get('compiled')
+        if compiled is None:
+            node = self.derivative_node()
+            if node is not None:
+                raise TypeError(f"patterns containing {type(node).__name__} cannot be compiled; "
+                                f"use matches() or DerivativeDesign")
+            with _compile_lock:
+                compiled = self.__dict__.setdefault('compiled', CompiledPattern(self))
+        return compiled
 
 
 class Empty(Pattern):
@@ -36,6 +90,10 @@ class Empty(Pattern):
         rulebook = NFARulebook([])
         return NFADesign(state_obj, {state_obj}, rulebook)
 
+    def thompson(self, compiler, fragments):
+        state = compiler.new_state()
+        return state, state
+
 
 class Literal(Pattern):
     precedence = 3
@@ -53,6 +111,11 @@ class Literal(Pattern):
         rulebook = NFARulebook([rule])
         return NFADesign(start_state, {accept_state}, rulebook)
 
+    def thompson(self, compiler, fragments):
+        start_state, accept_state = compiler.new_state(), compiler.new_state()
+        compiler.add_rule(start_state, self.character, accept_state)
+        return start_state, accept_state
+
 
 class Concatenate(Pattern):
     precedence = 1
@@ -79,6 +142,14 @@ class Concatenate(Pattern):
 
         return NFADesign(start_state, accept_states, rulebook)
 
+    def children(self):
+        return self.first, self.second
+
+    def thompson(self, compiler, fragments):
+        (first_start, first_accept), (second_start, second_accept) = fragments
+        compiler.add_rule(first_accept, None, second_start)
+        return first_start, second_accept
+
 
 class Choose(Pattern):
     precedence = 0
@@ -105,6 +176,16 @@ class Choose(Pattern):
 
         return NFADesign(start_state, accept_states, rulebook)
 
+    def children(self):
+        return self.first, self.second
+
+    def thompson(self, compiler, fragments):
+        start_state, accept_state = compiler.new_state(), compiler.new_state()
+        for fragment_start, fragment_accept in fragments:
+            compiler.add_rule(start_state, None, fragment_start)
+            compiler.add_rule(fragment_accept, None, accept_state)
+        return start_state, accept_state
+
 
 class Repeat(Pattern):
     precedence = 2
@@ -129,8 +210,894 @@ class Repeat(Pattern):
 
         return NFADesign(start_state, accept_states, rulebook)
 
+    def children(self):
+        return self.pattern,
+
+    def thompson(self, compiler, fragments):
+        (pattern_start, pattern_accept), = fragments
+        start_state, accept_state = compiler.new_state(), compiler.new_state()
+        compiler.add_rule(start_state, None, pattern_start)
+        compiler.add_rule(start_state, None, accept_state)
+        compiler.add_rule(pattern_accept, None, pattern_start)
+        compiler.add_rule(pattern_accept, None, accept_state)
+        return start_state, accept_state
+
+
+class Plus(Pattern):
+    precedence = 2
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+    def __repr__(self):
+        return self.pattern.bracket(self.precedence) + '+'
+
+    def children(self):
+        return self.pattern,
+
+    def thompson(self, compiler, fragments):
+        (pattern_start, pattern_accept), = fragments
+        accept_state = compiler.new_state()
+        compiler.add_rule(pattern_accept, None, pattern_start)
+        compiler.add_rule(pattern_accept, None, accept_state)
+        return pattern_start, accept_state
+
+
+class Optional(Pattern):
+    precedence = 2
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+    def __repr__(self):
+        return self.pattern.bracket(self.precedence) + '?'
+
+    def children(self):
+        return self.pattern,
+
+    def thompson(self, compiler, fragments):
+        (pattern_start, pattern_accept), = fragments
+        start_state, accept_state = compiler.new_state(), compiler.new_state()
+        compiler.add_rule(start_state, None, pattern_start)
+        compiler.add_rule(start_state, None, accept_state)
+        compiler.add_rule(pattern_accept, None, accept_state)
+        return start_state, accept_state
+
+
+# pattern{minimum,maximum}, with maximum None for no upper bound. The pattern
+# is built once and its fragment copied for the other repetitions, rather
+# than building an unrolled Concatenate/Choose tree; every optional copy gets
+# a single skip to the accept state, so closures stay constant-sized.
+class Counted(Pattern):
+    precedence = 2
+
+    def __init__(self, pattern, minimum, maximum=None):
+        if minimum < 0 or (maximum is not None and maximum < minimum):
+            raise ValueError(f"bad repeat count {{{minimum},{maximum}}}")
+        self.pattern = pattern
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def __repr__(self):
+        if self.maximum == self.minimum:
+            count = f"{self.minimum}"
+        else:
+            count = f"{self.minimum},{'' if self.maximum is None else self.maximum}"
+        return self.pattern.bracket(self.precedence) + f"{{{count}}}"
+
+    def children(self):
+        return self.pattern,
+
+    def thompson(self, compiler, fragments):
+        copies = max(self.minimum, 1) if self.maximum is None else self.maximum
+        subtree = compiler.subtree()
+        fragments = fragments[:copies] + [compiler.copy(subtree, fragments[0])
+                                          for _ in range(copies - 1)]
+
+        start_state, accept_state = compiler.new_state(), compiler.new_state()
+        state = start_state
+        for i, (pattern_start, pattern_accept) in enumerate(fragments):
+            compiler.add_rule(state, None, pattern_start)
+            if i >= self.minimum:
+                compiler.add_rule(state, None, accept_state)
+            state = pattern_accept
+        if self.maximum is None:
+            compiler.add_rule(state, None, fragments[-1][0])
+        compiler.add_rule(state, None, accept_state)
+        return start_state, accept_state
+
+
+# A set of characters given as CharacterRanges (or single characters), read by
+# one rule per merged range however wide it is. Negated classes read every
+# character outside the ranges.
+class CharacterClass(Pattern):
+    precedence = 3
+    MAX_CODE = 0x10FFFF
+
+    def __init__(self, ranges, negated=False):
+        self.items = [item if isinstance(item, CharacterRange) else CharacterRange(item, item)
+                      for item in ranges]
+        self.negated = negated
+
+        merged = []
+        for first, last in sorted(item.bounds for item in self.items):
+            if merged and first <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], last)
+            else:
+                merged.append([first, last])
+        if negated:
+            gaps, code = [], 0
+            for first, last in merged:
+                if first > code:
+                    gaps.append([code, first - 1])
+                code = last + 1
+            if code <= self.MAX_CODE:
+                gaps.append([code, self.MAX_CODE])
+            merged = gaps
+        self.ranges = [CharacterRange(chr(first), chr(last)) for first, last in merged]
+
+    def __repr__(self):
+        items = ''.join(item.first if item.first == item.last else f"{item}"
+                        for item in self.items)
+        return f"[{'^' if self.negated else ''}{items}]"
+
+    def thompson(self, compiler, fragments):
+        start_state, accept_state = compiler.new_state(), compiler.new_state()
+        for item in self.ranges:
+            compiler.add_rule(start_state, item.first if item.first == item.last else item,
+                              accept_state)
+        return start_state, accept_state
+
+
+# A capture group. Groups are numbered from 1 in the order their opening
+# brackets appear; the parser numbers them as it reads them and
+# number_groups() does it for hand-built trees.
+class Group(Pattern):
+    precedence = 3
+
+    def __init__(self, pattern, name=None, index=None):
+        self.pattern = pattern
+        self.name = name
+        self.index = index
+
+    def __repr__(self):
+        name = '' if self.name is None else f"?P<{self.name}>"
+        return f"({name}{self.pattern})"
+
+    def children(self):
+        return self.pattern,
+
+    def thompson(self, compiler, fragments):
+        (pattern_start, pattern_accept), = fragments
+        start_state, accept_state = compiler.new_state(), compiler.new_state()
+        compiler.saves[start_state] = 2 * self.index
+        compiler.saves[accept_state] = 2 * self.index + 1
+        compiler.add_rule(start_state, None, pattern_start)
+        compiler.add_rule(pattern_accept, None, accept_state)
+        return start_state, accept_state
+
+
+def number_groups(pattern):
+    groups = []
+    stack = [pattern]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Group):
+            groups.append(node)
+        stack.extend(reversed(node.children()))
+
+    count = max([group.index for group in groups if group.index is not None], default=0)
+    names = {}
+    for group in groups:
+        if group.index is None:
+            count += 1
+            group.index = count
+        if group.name is not None:
+            names[group.name] = group.index
+    return count, names
+
+
+# Builds the NFA for a whole pattern tree into one shared rule list with a
+# constant number of new states and rules per node. Nodes are visited
+# children first from an explicit stack, each turning its children's
+# (start, accept) fragments into its own, so neither deep nor long patterns
+# recurse or copy rule lists.
+#
+# Free moves out of a state are added in order of preference, greedy
+# repetition first, which is the priority PikeVM gives them. saves maps the
+# states of Group fragments to the capture slot they record.
+class ThompsonCompiler:
+    def __init__(self):
+        self.rules = []
+        self.state_count = 0
+        self.marks = (0, 0)
+        self.saves = {}
+
+    def new_state(self):
+        self.state_count += 1
+        return self.state_count - 1
+
+    def add_rule(self, status, character, next_status):
+        self.rules.append(FARule(status, character, next_status))
+
+    # The rules and states built for the children of the node being built,
+    # which are contiguous because children are built one whole subtree at a
+    # time.
+    def subtree(self):
+        rule_mark, state_mark = self.marks
+        return self.rules[rule_mark:], range(state_mark, self.state_count)
+
+    def copy(self, subtree, fragment):
+        rules, states = subtree
+        offset = self.state_count - states.start
+        self.state_count += len(states)
+        for rule in rules:
+            self.add_rule(rule.status + offset, rule.character, rule.next_status + offset)
+        for state in states:
+            if state in self.saves:
+                self.saves[state + offset] = self.saves[state]
+        start_state, accept_state = fragment
+        return start_state + offset, accept_state + offset
+
+    def fragment(self, pattern):
+        fragments = []
+        stack = [(pattern, None)]
+        while stack:
+            node, marks = stack.pop()
+            children = node.children()
+            if marks is not None or not children:
+                self.marks = marks or (len(self.rules), self.state_count)
+                split = len(fragments) - len(children)
+                node_fragment = node.thompson(self, fragments[split:])
+                del fragments[split:]
+                fragments.append(node_fragment)
+            else:
+                stack.append((node, (len(self.rules), self.state_count)))
+                stack.extend((child, None) for child in reversed(children))
+        return fragments.pop()
+
+    def to_nfa_design(self, pattern):
+        number_groups(pattern)
+        start_state, accept_state = self.fragment(pattern)
+        return NFADesign(start_state, {accept_state}, NFARulebook(self.rules))
+
+
+class PatternError(Exception):
+    def __init__(self, message, source, position):
+        super().__init__(f"{message} at position {position} in {source!r}")
+        self.source = source
+        self.position = position
+
+
+# choose        := concatenate ('|' concatenate)*
+# concatenate   := repeat*
+# repeat        := atom ('*' | '+' | '?' | '{' count '}')*
+# count         := digits | digits? ',' digits?
+# atom          := '(' ('?:' | '?P<' name '>')? choose ')' | '[' '^'? item+ ']'
+#                | '.' | '\\' any | any but '|*+?()[.'
+# item          := character | character '-' character | '\\' class letter
+#
+# A '{' that does not start a count is read as a literal, like in re.
+# Brackets capture unless they start with '?:'. '.' is any character but a
+# newline. \d, \w and \s (and \D, \W, \S for everything else) are the ASCII
+# classes, as under re.ASCII; \n, \t, \r, \f and \v are control characters,
+# and a backslash before any other letter or digit is an error rather than
+# the letter itself.
+class PatternParser:
+    CLASS_ESCAPES = {'d': [('0', '9')], 'w': [('a', 'z'), ('A', 'Z'), ('0', '9'), ('_', '_')],
+                     's': [(' ', ' '), ('\t', '\r')]}
+    CONTROL_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'f': '\f', 'v': '\v'}
+
+    def __init__(self, source):
+        self.source = source
+        self.position = 0
+        self.group_count = 0
+        self.group_names = set()
+
+    def error(self, message):
+        return PatternError(message, self.source, self.position)
+
+    def peek(self):
+        if self.position < len(self.source):
+            return self.source[self.position]
+        return None
+
+    def parse(self):
+        pattern = self.parse_choose()
+        if self.position < len(self.source):
+            raise self.error(f"unexpected {self.peek()!r}")
+        return pattern
+
+    def parse_choose(self):
+        pattern = self.parse_concatenate()
+        while self.peek() == '|':
+            self.position += 1
+            pattern = Choose(pattern, self.parse_concatenate())
+        return pattern
+
+    def parse_concatenate(self):
+        patterns = []
+        while self.peek() is not None and self.peek() not in '|)':
+            patterns.append(self.parse_repeat())
+        if not patterns:
+            return Empty()
+        pattern = patterns.pop()
+        while patterns:
+            pattern = Concatenate(patterns.pop(), pattern)
+        return pattern
+
+    def parse_repeat(self):
+        pattern = self.parse_atom()
+        while True:
+            character = self.peek()
+            if character == '*':
+                pattern = Repeat(pattern)
+            elif character == '+':
+                pattern = Plus(pattern)
+            elif character == '?':
+                pattern = Optional(pattern)
+            elif character == '{':
+                count = self.parse_count()
+                if count is None:
+                    return pattern
+                pattern = Counted(pattern, *count)
+                continue
+            else:
+                return pattern
+            self.position += 1
+
+    def parse_count(self):
+        start = self.position
+        self.position += 1
+        minimum = maximum = self.parse_digits()
+        if self.peek() == ',':
+            self.position += 1
+            minimum = minimum or 0
+            maximum = self.parse_digits()
+        if minimum is None or self.peek() != '}':
+            self.position = start
+            return None
+        if maximum is not None and maximum < minimum:
+            self.position = start
+            raise self.error('min repeat greater than max repeat')
+        self.position += 1
+        return minimum, maximum
+
+    def parse_digits(self):
+        start = self.position
+        while self.peek() is not None and self.peek().isdigit():
+            self.position += 1
+        if self.position == start:
+            return None
+        return int(self.source[start:self.position])
+
+    def parse_atom(self):
+        character = self.peek()
+        if character == '(':
+            self.position += 1
+            capturing, name = self.parse_group_kind()
+            if capturing:
+                self.group_count += 1
+                index = self.group_count
+            pattern = self.parse_choose()
+            if self.peek() != ')':
+                raise self.error("missing ')'")
+            self.position += 1
+            return Group(pattern, name, index) if capturing else pattern
+        if character == '[':
+            return self.parse_class()
+        if character in '*+?':
+            raise self.error("nothing to repeat")
+        if character == '.':
+            self.position += 1
+            return CharacterClass(['\n'], negated=True)
+        escaped = self.parse_class_escape()
+        if escaped is not None:
+            return escaped
+        self.position += 1
+        return Literal(self.parse_character())
+
+    # \d, \w, \s or their negations at the current position, as a class
+    def parse_class_escape(self):
+        if self.peek() != '\\' or self.position + 1 >= len(self.source):
+            return None
+        letter = self.source[self.position + 1]
+        if letter.lower() not in self.CLASS_ESCAPES:
+            return None
+        self.position += 2
+        items = [CharacterRange(first, last) for first, last in self.CLASS_ESCAPES[letter.lower()]]
+        return CharacterClass(items, negated=letter.isupper())
+
+    def parse_group_kind(self):
+        if self.peek() != '?':
+            return True, None
+        if self.source.startswith('?:', self.position):
+            self.position += 2
+            return False, None
+        if not self.source.startswith('?P<', self.position):
+            raise self.error('unknown extension')
+        end = self.source.find('>', self.position)
+        name = self.source[self.position + 3:end]
+        if end < 0 or not name.isidentifier():
+            raise self.error('bad group name')
+        if name in self.group_names:
+            raise self.error(f"redefinition of group name {name!r}")
+        self.group_names.add(name)
+        self.position = end + 1
+        return True, name
+
+    def parse_character(self):
+        character = self.source[self.position - 1]
+        if character == '\\':
+            character = self.peek()
+            if character is None:
+                raise self.error('trailing backslash')
+            if character in self.CONTROL_ESCAPES:
+                character = self.CONTROL_ESCAPES[character]
+            elif character.isascii() and character.isalnum():
+                raise self.error(f"bad escape \\{character}")
+            self.position += 1
+        return character
+
+    def parse_class(self):
+        start = self.position
+        self.position += 1
+        negated = self.peek() == '^'
+        if negated:
+            self.position += 1
+        items = []
+        # a ']' straight after the '[' or '[^' is a member, not the end
+        while self.peek() is not None and (self.peek() != ']' or not items):
+            escaped = self.parse_class_escape()
+            if escaped is not None:
+                items.extend(escaped.ranges)
+                continue
+            self.position += 1
+            first = self.parse_character()
+            if self.peek() == '-' and self.position + 1 < len(self.source) \
+                    and self.source[self.position + 1] != ']':
+                self.position += 2
+                last = self.parse_character()
+                if ord(first) > ord(last):
+                    raise self.error(f"bad character range {first}-{last}")
+                items.append(CharacterRange(first, last))
+            else:
+                items.append(first)
+        if self.peek() != ']':
+            self.position = start
+            raise self.error('unterminated character set')
+        self.position += 1
+        return CharacterClass(items, negated)
+
+
+def parse(source):
+    return PatternParser(source).parse()
+
+
+# Rewrites a pattern tree into an equivalent, usually smaller one:
+# - nested Concatenate and Choose chains are flattened into operand lists
+#   and rebuilt as balanced trees
+# - Empty operands, duplicate alternatives and stacked repetitions
+#   (Repeat(Repeat(x)), Plus(Repeat(x)), ...) are removed
+# - neighbouring alternatives sharing leading operands are factored, a|ab|ac
+#   becoming a(|b|c) and ab|ac|a becoming a(b|c)?; alternatives keep their
+#   order, which is their priority for PikeVM, so only an empty branch that
+#   comes last turns into Optional
+# - with captures off, Groups are replaced by what they contain
+# Nodes are hash-consed, so equal subtrees become one object and compare by
+# id. Like ThompsonCompiler it walks the tree from an explicit stack.
+class PatternOptimizer:
+    def __init__(self, captures=True):
+        self.captures = captures
+        self.nodes = {}
+        self.sequences = {}
+        self.alternatives = {}
+        self.empty = self.intern(('Empty',), Empty)
+        self.sequences[id(self.empty)] = []
+
+    def intern(self, key, make):
+        node = self.nodes.get(key)
+        if node is None:
+            node = self.nodes[key] = make()
+        return node
+
+    @staticmethod
+    def operands(node):
+        if type(node) not in (Concatenate, Choose):
+            return list(node.children())
+        operands = []
+        stack = [node]
+        while stack:
+            operand = stack.pop()
+            if type(operand) is type(node):
+                stack.extend([operand.second, operand.first])
+            else:
+                operands.append(operand)
+        return operands
+
+    def optimize(self, pattern):
+        done = {}
+        stack = [(pattern, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if id(node) in done:
+                continue
+            operands = self.operands(node)
+            if expanded:
+                done[id(node)] = self.rebuild(node, [done[id(operand)] for operand in operands])
+            else:
+                stack.append((node, True))
+                stack.extend((operand, False) for operand in operands if id(operand) not in done)
+        return done[id(pattern)]
+
+    def rebuild(self, node, children):
+        kind = type(node)
+        if kind is Empty:
+            return self.empty
+        if kind is Literal:
+            return self.intern(('Literal', node.character), lambda: node)
+        if kind is CharacterClass:
+            bounds = tuple(item.bounds for item in node.ranges)
+            if len(bounds) == 1 and bounds[0][0] == bounds[0][1]:
+                return self.intern(('Literal', chr(bounds[0][0])), lambda: Literal(chr(bounds[0][0])))
+            return self.intern(('CharacterClass', bounds), lambda: node)
+        if kind is Concatenate:
+            return self.concatenation(children)
+        if kind is Choose:
+            return self.choice(children)
+        if kind is Repeat:
+            return self.repeat(*children)
+        if kind is Plus:
+            return self.plus(*children)
+        if kind is Optional:
+            return self.optional(*children)
+        if kind is Counted:
+            return self.counted(*children, node.minimum, node.maximum)
+        if kind is Group:
+            pattern, = children
+            if not self.captures:
+                return pattern
+            return self.intern(('Group', id(pattern), node.name, node.index),
+                               lambda: Group(pattern, node.name, node.index))
+        return node
+
+    def balanced(self, kind, patterns, parts):
+        level = patterns
+        while len(level) > 1:
+            paired = []
+            for i in range(0, len(level) - 1, 2):
+                first, second = level[i], level[i + 1]
+                pattern = self.intern((kind.__name__, id(first), id(second)),
+                                      lambda: kind(first, second))
+                parts.setdefault(id(pattern), parts.get(id(first), [first])
+                                 + parts.get(id(second), [second]))
+                paired.append(pattern)
+            if len(level) % 2:
+                paired.append(level[-1])
+            level = paired
+        return level[0]
+
+    def concatenation(self, patterns):
+        operands = [operand for pattern in patterns
+                    for operand in self.sequences.get(id(pattern), [pattern])]
+        if not operands:
+            return self.empty
+        return self.balanced(Concatenate, operands, self.sequences)
+
+    def choice(self, patterns):
+        alternatives = list({id(alternative): alternative for pattern in patterns
+                             for alternative in self.alternatives.get(id(pattern), [pattern])}
+                            .values())
+
+        # a trie of the alternatives' operand lists, with None marking where
+        # one of them ends; an alternative only shares a branch with the one
+        # right before it, so the order of alternatives is kept
+        root = {}
+        for alternative in alternatives:
+            trie = root
+            for operand in self.sequences.get(id(alternative), [alternative]):
+                last = next(reversed(trie), None)
+                if last is None or trie[last] is None or trie[last][0] is not operand:
+                    last = len(trie)
+                    trie[last] = (operand, {})
+                trie = trie[last][1]
+            trie[len(trie)] = None
+
+        results = {}
+        stack = [(root, False)]
+        while stack:
+            trie, expanded = stack.pop()
+            branches = []
+            for branch in trie.values():
+                if branch is None:
+                    branches.append(None)
+                    continue
+                operand, rest = branch
+                operands = [operand]
+                while len(rest) == 1 and rest[0] is not None:
+                    operand, rest = rest[0]
+                    operands.append(operand)
+                branches.append((operands, rest))
+            if not expanded:
+                stack.append((trie, True))
+                stack.extend((branch[1], False) for branch in branches if branch and branch[1])
+                continue
+
+            options = [self.empty if branch is None else
+                       self.concatenation(branch[0] + [results[id(branch[1])]] if branch[1]
+                                          else branch[0])
+                       for branch in branches]
+            if len(options) > 1 and options[-1] is self.empty and self.empty not in options[:-1]:
+                results[id(trie)] = self.optional(self.balanced(Choose, options[:-1],
+                                                                self.alternatives))
+            else:
+                results[id(trie)] = self.balanced(Choose, options, self.alternatives)
+        return results[id(root)]
+
+    def repeat(self, pattern):
+        while type(pattern) in (Repeat, Plus, Optional):
+            pattern = pattern.pattern
+        if pattern is self.empty:
+            return self.empty
+        return self.intern(('Repeat', id(pattern)), lambda: Repeat(pattern))
+
+    def plus(self, pattern):
+        if pattern is self.empty or type(pattern) in (Repeat, Plus):
+            return pattern
+        if type(pattern) is Optional:
+            return self.repeat(pattern)
+        return self.intern(('Plus', id(pattern)), lambda: Plus(pattern))
+
+    def optional(self, pattern):
+        if pattern is self.empty or type(pattern) in (Repeat, Optional):
+            return pattern
+        if type(pattern) is Plus:
+            return self.repeat(pattern)
+        return self.intern(('Optional', id(pattern)), lambda: Optional(pattern))
+
+    def counted(self, pattern, minimum, maximum):
+        if maximum == 0 or pattern is self.empty:
+            return self.empty
+        if (minimum, maximum) == (1, 1):
+            return pattern
+        if maximum is None and minimum <= 1:
+            return self.plus(pattern) if minimum else self.repeat(pattern)
+        if (minimum, maximum) == (0, 1):
+            return self.optional(pattern)
+        return self.intern(('Counted', id(pattern), minimum, maximum),
+                           lambda: Counted(pattern, minimum, maximum))
+
+
+def optimize(pattern, captures=True):
+    return PatternOptimizer(captures).optimize(pattern)
+
+
+def _common_prefix(first, second):
+    length = 0
+    for a, b in zip(first, second):
+        if a != b:
+            break
+        length += 1
+    return first[:length]
+
+
+def _common_suffix(first, second):
+    return _common_prefix(first[::-1], second[::-1])[::-1]
+
+
+# (prefix, required): a literal every match starts with, and the longest
+# literal every match contains, either possibly ''. Each node gets
+# (exact, prefix, suffix, best), exact being the one string it matches, if
+# there is one, and best its longest required literal.
+def required_literals(pattern):
+    unknown = (None, '', '', '')
+    infos = {}
+    stack = [(pattern, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if id(node) in infos:
+            continue
+        children = node.children()
+        if not expanded and children:
+            stack.append((node, True))
+            stack.extend((child, False) for child in children)
+            continue
+
+        kind = type(node)
+        child_infos = [infos[id(child)] for child in children]
+        if kind is Empty:
+            info = ('', '', '', '')
+        elif kind is Literal:
+            info = (node.character,) * 4
+        elif kind is CharacterClass and len(node.ranges) == 1 \
+                and node.ranges[0].first == node.ranges[0].last:
+            info = (node.ranges[0].first,) * 4
+        elif kind is Concatenate:
+            (exact, prefix, suffix, best), (second_exact, second_prefix, second_suffix,
+                                            second_best) = child_infos
+            info = (None if exact is None or second_exact is None else exact + second_exact,
+                    prefix if exact is None else exact + second_prefix,
+                    second_suffix if second_exact is None else suffix + second_exact,
+                    max(best, second_best, suffix + second_prefix, key=len))
+        elif kind is Choose:
+            (exact, prefix, suffix, best), (second_exact, second_prefix, second_suffix, _) = \
+                child_infos
+            if exact is not None and exact == second_exact:
+                info = (exact,) * 4
+            else:
+                prefix = _common_prefix(prefix, second_prefix)
+                suffix = _common_suffix(suffix, second_suffix)
+                info = (None, prefix, suffix, max(prefix, suffix, key=len))
+        elif kind is Plus or (kind is Counted and node.minimum > 0):
+            info = (None,) + child_infos[0][1:]
+        elif kind is Group:
+            info = child_infos[0]
+        else:
+            info = unknown
+        infos[id(node)] = info
+
+    _, prefix, _, required = infos[id(pattern)]
+    return prefix, required
+
+
+# Builds its automaton on first use and then serves any number of matches.
+# Patterns whose DFA stays within dfa_state_limit states run on the minimized
+# DFA table, larger ones on the bitmask NFA, and NFAs past nfa_rule_limit
+# rules, whose bitmasks would get too wide, on the indexed rulebook. NFAs
+# past subset_rule_limit rules go to the bitmask NFA without trying the
+# subset construction, which would rarely stay within the DFA limit.
+# Character classes label their rules with CharacterRanges; those patterns run
+# over alphabet classes instead of characters, behind an AlphabetPartition.
+#
+# The automaton and the searcher ignore capture groups. Matches of patterns
+# with groups are found by the searcher first, and the PikeVM then only runs
+# over the matched text to fill in the groups.
+class CompiledPattern:
+    dfa_state_limit = 1000
+    subset_rule_limit = 1000
+    nfa_rule_limit = 20000
+
+    def __init__(self, pattern, source=None):
+        self.pattern = pattern
+        self.source = source
+        self.groups, self.groupindex = number_groups(pattern)
+        self.lock = threading.Lock()
+        self.automaton = None
+        self.searcher = None
+        self.pike_vm = None
+        self.optimized_patterns = {}
+
+    def __repr__(self):
+        source = f"{self.pattern}" if self.source is None else self.source
+        return f"compile({source!r})"
+
+    def optimized(self, captures=False):
+        optimized = self.optimized_patterns.get(captures)
+        if optimized is None:
+            optimized = self.optimized_patterns[captures] = optimize(self.pattern, captures)
+        return optimized
+
+    def nfa_design(self, compiler=None, captures=False):
+        compiler = ThompsonCompiler() if compiler is None else compiler
+        return compiler.to_nfa_design(self.optimized(captures))
+
+    def partitioned_nfa_design(self, compiler=None, captures=False):
+        nfa_design = self.nfa_design(compiler, captures)
+        if not any(isinstance(rule.character, CharacterRange) for rule in nfa_design.rulebook.rules):
+            return None, nfa_design
+        partitioned = PartitionedDesign.from_nfa_design(nfa_design)
+        return partitioned.partition, partitioned.design
+
+    def build(self):
+        partition, nfa_design = self.partitioned_nfa_design()
+        automaton = self.engine(nfa_design)
+        return automaton if partition is None else PartitionedDesign(partition, automaton)
+
+    def engine(self, nfa_design):
+        if len(nfa_design.rulebook.rules) > self.nfa_rule_limit:
+            return NFADesign(nfa_design.start_state, nfa_design.accept_states,
+                             nfa_design.rulebook.indexed())
+        if len(nfa_design.rulebook.rules) > self.subset_rule_limit:
+            return nfa_design.compile()
+        try:
+            simulation = NFASimulation(nfa_design, max_states=self.dfa_state_limit)
+            return simulation.to_dfa_design().minimize().compile()
+        except StateLimitExceeded:
+            return nfa_design.compile()
+
+    def compiled(self):
+        automaton = self.automaton
+        if automaton is None:
+            with self.lock:
+                if self.automaton is None:
+                    self.automaton = self.build()
+                automaton = self.automaton
+        return automaton
+
+    def fullmatch(self, string):
+        return self.compiled().accepts(string)
+
+    def matches(self, string):
+        return self.fullmatch(string)
+
+    def compiled_searcher(self):
+        searcher = self.searcher
+        if searcher is None:
+            with self.lock:
+                if self.searcher is None:
+                    partition, nfa_design = self.partitioned_nfa_design()
+                    self.searcher = Searcher(nfa_design.compile(), partition,
+                                             *required_literals(self.optimized()))
+                searcher = self.searcher
+        return searcher
+
+    def compiled_pike_vm(self):
+        pike_vm = self.pike_vm
+        if pike_vm is None:
+            with self.lock:
+                if self.pike_vm is None:
+                    compiler = ThompsonCompiler()
+                    partition, nfa_design = self.partitioned_nfa_design(compiler, captures=True)
+                    self.pike_vm = PikeVM(nfa_design, compiler.saves, self.groups,
+                                          self.groupindex, partition)
+                pike_vm = self.pike_vm
+        return pike_vm
+
+    def captured(self, match):
+        if match is None or not self.groups:
+            return match
+        return self.compiled_pike_vm().match(match.text, match.start, match.end)
+
+    def search(self, text, position=0, end=None):
+        return self.captured(self.compiled_searcher().search(text, position, end))
+
+    def match(self, text, position=0, end=None):
+        return self.compiled_pike_vm().match(text, position, end)
+
+    def finditer(self, text, position=0, end=None):
+        matches = self.compiled_searcher().finditer(text, position, end)
+        if not self.groups:
+            return matches
+        return map(self.captured, matches)
+
+    def findall(self, text, position=0, end=None):
+        return self.compiled_searcher().findall(text, position, end)
+
+
+_compile_lock = threading.Lock()
+MAXCACHE = 512
+_cache = OrderedDict()
+# move_to_end and popitem aren't safe against each other across threads;
+# patterns are parsed outside the lock, and a racing compile of the same
+# source keeps whichever got in first
+_cache_lock = threading.Lock()
+
+
+def compile(source):
+    with _cache_lock:
+        compiled = _cache.get(source)
+        if compiled is not None:
+            _cache.move_to_end(source)
+            return compiled
+
+    compiled = CompiledPattern(parse(source), source)
+    with _cache_lock:
+        compiled = _cache.setdefault(source, compiled)
+        _cache.move_to_end(source)
+        if len(_cache) > MAXCACHE:
+            _cache.popitem(last=False)
+    return compiled
+
+
+def purge():
+    with _cache_lock:
+        _cache.clear()
+
 
 if __name__ == '__main__':
+    from the_simplest_computers.lazy_dfa import LazyDFADesign
+    from the_simplest_computers.streaming import stream_matcher
+
     pattern = Repeat(Choose(Concatenate(Literal('a'),
                                         Literal('b')),
                             Literal('a')))
@@ -190,3 +1157,114 @@ if __name__ == '__main__':
           pattern.matches('abab'),
           pattern.matches('abaab'),
           pattern.matches('abba'))
+
+    # parse and compile
+    for source in ['a(b|c)*', 'ab|a', '(a(|b))*', 'a**', '\\(\\*']:
+        pattern = parse(source)
+        print(repr(source), pattern, compile(source))
+
+    compiled = compile('a(b|c)*')
+    print(compiled is compile('a(b|c)*'),
+          compiled.matches('a'),
+          compiled.matches('abcb'),
+          compiled.matches('ba'))
+
+    for source in ['(ab', 'ab)', '*a', 'a\\']:
+        try:
+            parse(source)
+        except PatternError as error:
+            print(error)
+
+    # compile once
+    pattern = Repeat(Choose(Concatenate(Literal('a'), Literal('b')), Literal('a')))
+    compiled = pattern.compile()
+    print(compiled, compiled.automaton, pattern.compile() is compiled)
+    print(pattern.matches('aba'), compiled.fullmatch('abab'), compiled.fullmatch('bb'), compiled.compiled())
+
+    wide = parse('(a|b)*a(a|b)(a|b)(a|b)(a|b)(a|b)(a|b)(a|b)(a|b)(a|b)(a|b)').compile()
+    print(wide.fullmatch('ab' * 10 + 'a' + 'b' * 10), type(wide.compiled()).__name__)
+
+    # search
+    compiled = compile('ab*|b')
+    print(compiled.search('xxabbbyb'),
+          compiled.search('xyz'),
+          compiled.findall('abbxbab'),
+          compiled.findall(b'abbxbab'),
+          [match.span() for match in compile('a*').finditer('baab')])
+    # a thread reading past a match's end isn't read again for the next one
+    print(len(compile('a*b|a').findall('a' * 20000)), compile('a*b|a').findall('aaab'))
+
+    # thompson construction
+    pattern = Literal('a')
+    for _ in range(20000):
+        pattern = Concatenate(pattern, Choose(Literal('b'), Concatenate(Literal('c'),
+                                                                        Repeat(Literal('d')))))
+    # states are numbered from 0, and the start state can accept
+    print(ThompsonCompiler().to_nfa_design(Empty()).accepts(''),
+          ThompsonCompiler().to_nfa_design(Repeat(Literal('a'))).accepts(''),
+          ThompsonCompiler().to_nfa_design(Literal('a')).accepts(''))
+    nfa_design = ThompsonCompiler().to_nfa_design(pattern)
+    print(len(nfa_design.rulebook.rules),
+          pattern.compile().fullmatch('a' + 'b' * 20000),
+          pattern.compile().fullmatch('a' + 'cddb' * 10000),
+          pattern.compile().fullmatch('ba'),
+          type(pattern.compile().compiled()).__name__)
+
+    # counted repetition and character classes
+    for source in ['a+b?', '(ab){2,3}', 'x{2,}', '[a-z_][a-z0-9_]*', '[^0-9]+', 'a{,2}', '[]a-]']:
+        print(repr(source), parse(source), compile(source).fullmatch('ab'))
+
+    # escapes: ASCII classes, control characters, and errors for the rest
+    print(compile('\\d+').fullmatch('123'), compile('\\d+').fullmatch('dd'),
+          compile('a.c').fullmatch('abc'), compile('a.c').fullmatch('a\nc'),
+          compile('a\\.c').fullmatch('abc'), compile('[\\w-]+\\s\\D').findall('x-1 y z_ 2'))
+    for source in ['\\q', '\\1', '[a\\z]']:
+        try:
+            parse(source)
+        except PatternError as error:
+            print(error)
+
+    # range-labelled designs read plain characters too, compiled, determinized,
+    # lazily determinized or streamed
+    for source, string in [('[ab]', 'a'), ('a|[ab]', 'b'), ('a[^a]', 'ab'), ('[a-c]+', 'cab'),
+                           ('a[^a]', 'aa'), ('b|[a-c]d', 'b'), ('b|[a-c]d', 'ad')]:
+        pattern = parse(source)
+        nfa_design = pattern.to_nfa_design()
+        dfa_design = NFASimulation(nfa_design).to_dfa_design()
+        answers = {nfa_design.accepts(string), nfa_design.compile().accepts(string),
+                   dfa_design.accepts(string), dfa_design.compile().accepts(string),
+                   dfa_design.minimize().accepts(string),
+                   LazyDFADesign(nfa_design).accepts(string),
+                   stream_matcher(nfa_design).feed(string).accepting(),
+                   stream_matcher(dfa_design).feed(string.encode()).accepting()}
+        print(repr(source), repr(string), answers, pattern.matches(string))
+
+    compiled = compile('[a-z]{1,1000}@[一-鿿]+')
+    print(len(compiled.nfa_design().rulebook.rules),
+          compiled.fullmatch('x' * 1000 + '@汉字'),
+          compiled.fullmatch('x' * 1001 + '@汉字'),
+          compiled.fullmatch('@汉字'),
+          compiled.search('## user@中文 ##'),
+          type(compiled.compiled()).__name__)
+    print(len(parse('[\u0000-\U0010ffff]').compile().nfa_design().rulebook.rules),
+          Counted(CharacterClass([CharacterRange('a', 'c')]), 2).to_nfa_design().rulebook)
+
+    # optimizer and literal prefilter
+    for source in ['(a|ab|ac)d', '(ab|ac|a)d', 'a**', '(a+)*|()', 'x(yz)?yz', 'foo[0-9]+bar|foo[0-9]+baz', 'a{1}b{0}']:
+        pattern = optimize(parse(source))
+        print(repr(source), pattern, required_literals(pattern))
+
+    text = ' ' * 100000 + 'user@example.com' + ' ' * 100000
+    compiled = compile('[a-z]+@example\\.com')
+    print(compiled.search(text).span(), compiled.findall(text.encode()),
+          compiled.search('no match here'), compile('ab[0-9]').findall('xab1yab2ab'))
+
+    # capture groups
+    compiled = compile('(?P<user>[a-z]+)@((?:[a-z]+\\.)+)(com|org)')
+    match = compiled.search('mail root@mail.example.org now')
+    print(compiled.groups, match, match.groups(), match.span(2), match.groupdict())
+    print(compile('(a|ab)(c|bcd)(d*)').match('abcd').groups(),
+          compile('(a*)+b|(x)').search('xaab').groups(),
+          [match.groups() for match in compile('([0-9]+)-([0-9]+)').finditer('1-2, 30-40')],
+          compile('(a)|b').match('b').groups('-'),
+          Concatenate(Group(Literal('a')), Group(Repeat(Literal('b')))).compile().match('abb').groups())
@@ -0,0 +1,322 @@
+from collections import deque
+
+
+# spans holds (start, end), or None when the group took no part in the
+# match, for each capture group from 1 on; names maps group names to numbers.
+class Match:
+    def __init__(self, text, start, end, spans=(), names=None):
+        self.text = text
+        self.start = start
+        self.end = end
+        self.spans = tuple(spans)
+        self.names = {} if names is None else names
+
+    def __repr__(self):
+        return f"<Match span=({self.start}, {self.end}) match={self.group()!r}>"
+
+    def span(self, index=0):
+        if index == 0:
+            return self.start, self.end
+        return self.spans[self.names.get(index, index) - 1]
+
+    def group(self, index=0):
+        span = self.span(index)
+        return None if span is None else self.text[span[0]:span[1]]
+
+    def groups(self, default=None):
+        return tuple(default if span is None else self.text[span[0]:span[1]]
+                     for span in self.spans)
+
+    def groupdict(self, default=None):
+        return {name: default if self.group(name) is None else self.group(name)
+                for name in self.names}
+
+
+# Leftmost-longest search over a BitNFADesign. A single forward scan keeps one
+# thread per NFA state tagged with the offset it started at; a new thread
+# starts at every offset until some thread accepts, and when two threads meet
+# in one state the one that started first survives. Once a match is known,
+# threads that started after it are dropped, and the match is final when no
+# thread that could still extend or precede it is left.
+#
+# str is read character by character; bytes, bytearray, memoryview and mmap
+# are indexed byte by byte, each byte standing for the character with the
+# same code point. With an AlphabetPartition the design reads alphabet
+# classes, and each character is looked up in it first.
+#
+# prefix is a literal every match starts with and required one every match
+# contains. Texts with a find method (str, bytes, bytearray, mmap) are first
+# checked for required, and whenever no thread is left the scan jumps
+# straight to the next occurrence of prefix.
+class Searcher:
+    def __init__(self, design, partition=None, prefix='', required=''):
+        self.design = design
+        self.partition = partition
+        self.prefix = prefix
+        self.required = '' if required in prefix else required
+        self.start_states = list(design.bits(design.start_mask))
+
+    @staticmethod
+    def needle(literal, text):
+        if not literal or not hasattr(text, 'find'):
+            return None
+        if isinstance(text, str):
+            return literal
+        try:
+            return literal.encode('latin-1')
+        except UnicodeEncodeError:
+            return None
+
+    def possible(self, text, position, end):
+        required = self.needle(self.required, text)
+        return required is None or text.find(required, position, end) >= 0
+
+    def scan(self, text, position, end):
+        moves = self.design.moves
+        sources = self.design.sources
+        accept_mask = self.design.accept_mask
+        bits = self.design.bits
+        is_text = isinstance(text, str)
+        class_of = None if self.partition is None else self.partition.class_of
+        prefix = self.needle(self.prefix, text)
+
+        active = {}
+        best_start = best_end = -1
+        while True:
+            if best_start < 0:
+                if prefix is not None and not active:
+                    position = text.find(prefix, position, end)
+                    if position < 0:
+                        break
+                for state in self.start_states:
+                    active.setdefault(state, position)
+
+            for state, start in active.items():
+                if accept_mask >> state & 1:
+                    if best_start < 0 or start < best_start or (start == best_start
+                                                                and position > best_end):
+                        best_start, best_end = start, position
+            if best_start >= 0:
+                active = {state: start for state, start in active.items() if start <= best_start}
+
+            if not active or position >= end:
+                break
+
+            character = text[position] if is_text else chr(text[position])
+            if class_of is not None:
+                character = class_of(character)
+            position += 1
+            state_moves = moves.get(character)
+            if state_moves is None:
+                active = {}
+                continue
+            character_sources = sources[character]
+            next_active = {}
+            for state, start in active.items():
+                if character_sources >> state & 1:
+                    for next_state in bits(state_moves[state]):
+                        if next_active.get(next_state, end + 1) > start:
+                            next_active[next_state] = start
+            active = next_active
+
+        if best_start < 0:
+            return None
+        return best_start, best_end
+
+    def search(self, text, position=0, end=None):
+        end = len(text) if end is None else min(end, len(text))
+        if not self.possible(text, position, end):
+            return None
+        span = self.scan(text, position, end)
+        return None if span is None else Match(text, *span)
+
+    # Runs the searches one after another would make in a single pass, so a
+    # thread read past the end of one match is not read again by the next.
+    # levels holds the best (start, end) of each search not yet final, each
+    # starting at or after the end of the one before; threads that started
+    # inside a level's match are dropped. Two threads meeting in one state
+    # can still keep only the earlier: if it goes on to accept, the level it
+    # belongs to ends past where the later one started.
+    def finditer(self, text, position=0, end=None):
+        end = len(text) if end is None else min(end, len(text))
+        if position > end or not self.possible(text, position, end):
+            return
+        moves = self.design.moves
+        sources = self.design.sources
+        accept_mask = self.design.accept_mask
+        bits = self.design.bits
+        is_text = isinstance(text, str)
+        class_of = None if self.partition is None else self.partition.class_of
+        prefix = self.needle(self.prefix, text)
+        required = self.needle(self.required, text)
+        start_accepts = any(accept_mask >> state & 1 for state in self.start_states)
+
+        active = {}
+        levels = deque()
+        lower = position
+        required_at = -1
+
+        def record(start):
+            nonlocal active, lower
+            while levels and start <= levels[-1][0]:
+                levels.pop()
+            levels.append((start, position))
+            active = {state: first for state, first in active.items() if first <= start}
+            lower = position if start < position else position + 1
+
+        while True:
+            # accepting threads all started before position, and only the
+            # earliest counts: recording it drops every later one
+            accepted = [start for state, start in active.items() if accept_mask >> state & 1]
+            if accepted:
+                record(min(accepted))
+
+            if levels:
+                earliest = min(active.values(), default=end + 1)
+                while levels and levels[0][0] < earliest:
+                    yield Match(text, *levels.popleft())
+
+            if not active:
+                if position >= end and lower > position:
+                    break
+                position = max(position, lower)
+                if required is not None and required_at < position:
+                    required_at = text.find(required, position, end)
+                    if required_at < 0:
+                        break
+                if prefix is not None:
+                    position = text.find(prefix, position, end)
+                    if position < 0:
+                        break
+
+            if position >= lower:
+                for state in self.start_states:
+                    active.setdefault(state, position)
+                if start_accepts:
+                    record(position)
+
+            if position >= end:
+                break
+
+            character = text[position] if is_text else chr(text[position])
+            if class_of is not None:
+                character = class_of(character)
+            position += 1
+            state_moves = moves.get(character)
+            if state_moves is None:
+                active = {}
+                continue
+            character_sources = sources[character]
+            next_active = {}
+            for state, start in active.items():
+                if character_sources >> state & 1:
+                    for next_state in bits(state_moves[state]):
+                        if next_active.get(next_state, end + 1) > start:
+                            next_active[next_state] = start
+            active = next_active
+
+        for span in levels:
+            yield Match(text, *span)
+
+    def findall(self, text, position=0, end=None):
+        return [match.group() for match in self.finditer(text, position, end)]
+
+
+# A Pike VM over a Thompson NFA (int states, free moves listed in order of
+# preference) that records capture offsets. Threads are kept in priority
+# order and each state holds at most one thread per step, the first to get
+# there, so a scan takes O(len(text) * states * groups) time whatever the
+# pattern. The overall match is leftmost-longest, like Searcher; among
+# threads giving that same match the highest-priority one supplies the groups.
+# Unlike re, a repetition never takes an extra iteration matching nothing, so
+# (b|)+ against 'b' captures 'b' rather than ''.
+#
+# saves maps states to the capture slot they record: 2 * group for its start
+# and 2 * group + 1 for its end.
+class PikeVM:
+    def __init__(self, nfa_design, saves, group_count, names=None, partition=None):
+        self.start_state = nfa_design.start_state
+        self.accept_states = set(nfa_design.accept_states)
+        self.saves = saves
+        self.group_count = group_count
+        self.names = names
+        self.partition = partition
+
+        self.free_moves = {}
+        self.moves = {}
+        for rule in nfa_design.rulebook.rules:
+            if rule.character is None:
+                self.free_moves.setdefault(rule.status, []).append(rule.next_status)
+            else:
+                self.moves.setdefault(rule.status, {}).setdefault(rule.character, []).append(
+                    rule.next_status)
+
+    def add_thread(self, threads, seen, state, captures, position):
+        free_moves = self.free_moves
+        saves = self.saves
+        stack = [(state, captures)]
+        while stack:
+            state, captures = stack.pop()
+            if state in seen:
+                continue
+            seen.add(state)
+            slot = saves.get(state)
+            if slot is not None:
+                captures = captures[:slot] + (position,) + captures[slot + 1:]
+            if state in self.moves or state in self.accept_states:
+                threads.append((state, captures))
+            stack.extend((next_state, captures)
+                         for next_state in reversed(free_moves.get(state, ())))
+
+    def scan(self, text, position, end, anchored=False):
+        moves = self.moves
+        accept_states = self.accept_states
+        is_text = isinstance(text, str)
+        class_of = None if self.partition is None else self.partition.class_of
+        empty = (None,) * (2 * self.group_count + 2)
+
+        threads, seen = [], set()
+        first = position
+        best = None
+        while True:
+            if best is None and (not anchored or position == first):
+                self.add_thread(threads, seen, self.start_state, (position,) + empty[1:], position)
+
+            for state, captures in threads:
+                if state in accept_states:
+                    if best is None or captures[0] < best[0] or (captures[0] == best[0]
+                                                                and position > best[1]):
+                        best = (captures[0], position, captures)
+            if best is not None:
+                threads = [thread for thread in threads if thread[1][0] <= best[0]]
+
+            if not threads or position >= end:
+                break
+
+            character = text[position] if is_text else chr(text[position])
+            if class_of is not None:
+                character = class_of(character)
+            position += 1
+            next_threads, seen = [], set()
+            for state, captures in threads:
+                for next_state in moves.get(state, {}).get(character, ()):
+                    self.add_thread(next_threads, seen, next_state, captures, position)
+            threads = next_threads
+        return best
+
+    def to_match(self, text, best):
+        if best is None:
+            return None
+        start, end, captures = best
+        spans = [None if captures[2 * group] is None or captures[2 * group + 1] is None
+                 else (captures[2 * group], captures[2 * group + 1])
+                 for group in range(1, self.group_count + 1)]
+        return Match(text, start, end, spans, self.names)
+
+    def search(self, text, position=0, end=None):
+        end = len(text) if end is None else min(end, len(text))
+        return self.to_match(text, self.scan(text, position, end))
+
+    def match(self, text, position=0, end=None):
+        end = len(text) if end is None else min(end, len(text))
+        return self.to_match(text, self.scan(text, position, end, anchored=True))
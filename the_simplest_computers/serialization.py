@@ -0,0 +1,279 @@
+import mmap
+import struct
+import sys
+
+from the_simplest_computers.finite_automata import BitNFADesign, DFADesign, DFATable, NFADesign
+
+# Layout, little-endian, every section starting on an 8 byte boundary:
+#
+#   header        magic, version, kind, states, symbols, start state,
+#                 mask count, symbol blob size, mask blob size
+#   symbols       u32 offsets[symbols + 1], utf-8 blob
+#   DFA           u32 transitions[states * (symbols + 1)], accept bitmap
+#   NFA           u64 mask offsets[masks + 1], mask blob,
+#                 u32 closure entries[states], u32 move entries[symbols * states],
+#                 u32 source entries[symbols]
+#
+# NFA masks are stored as variable-length little-endian integers and only
+# decoded when the loaded automaton first touches them; entry 0 is the
+# accept mask and NO_ENTRY marks a state without a move.
+MAGIC = b'UCFA'
+VERSION = 1
+DFA_KIND = 1
+NFA_KIND = 2
+NO_ENTRY = 0xFFFFFFFF
+HEADER = struct.Struct('<4sHHIIIIQQ')
+
+
+class FormatError(Exception):
+    pass
+
+
+def _padding(size):
+    return -size % 8
+
+
+def _array(format_character, values):
+    return struct.pack(f"<{len(values)}{format_character}", *values)
+
+
+class Bitmap:
+    def __init__(self, view, length):
+        self.view = view
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        return bool(self.view[i >> 3] >> (i & 7) & 1)
+
+    def __iter__(self):
+        return (self[i] for i in range(self.length))
+
+    @staticmethod
+    def pack(flags):
+        bitmap = bytearray((len(flags) + 7) // 8)
+        for i, flag in enumerate(flags):
+            if flag:
+                bitmap[i >> 3] |= 1 << (i & 7)
+        return bytes(bitmap)
+
+
+class MaskTable:
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def mask(self, entry):
+        return int.from_bytes(self.blob[self.offsets[entry]:self.offsets[entry + 1]], 'little')
+
+
+class LazyMasks(dict):
+    def __init__(self, masks, entries):
+        super().__init__()
+        self.masks = masks
+        self.entries = entries
+
+    def __contains__(self, i):
+        return dict.__contains__(self, i) or self.entries[i] != NO_ENTRY
+
+    def __missing__(self, i):
+        entry = self.entries[i]
+        if entry == NO_ENTRY:
+            raise KeyError(i)
+        mask = self[i] = self.masks.mask(entry)
+        return mask
+
+
+class LazyMaskList:
+    def __init__(self, masks, entries):
+        self.masks = masks
+        self.entries = entries
+        self.cache = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, i):
+        mask = self.cache.get(i)
+        if mask is None:
+            mask = self.cache[i] = self.masks.mask(self.entries[i])
+        return mask
+
+
+def _symbol_sections(symbols):
+    encoded = []
+    for character in symbols:
+        if not isinstance(character, str):
+            raise FormatError(f"cannot serialize symbol {character!r}")
+        encoded.append(character.encode('utf-8'))
+    offsets = [0]
+    for blob in encoded:
+        offsets.append(offsets[-1] + len(blob))
+    return [_array('I', offsets), b''.join(encoded)]
+
+
+def _pack(kind, states, symbols, start_state, masks, sections):
+    symbol_sections = _symbol_sections(symbols)
+    mask_bytes = len(sections[1]) if kind == NFA_KIND else 0
+    chunks = [HEADER.pack(MAGIC, VERSION, kind, states, len(symbols), start_state,
+                          masks, len(symbol_sections[1]), mask_bytes)]
+    for section in symbol_sections + sections:
+        chunks.append(section)
+        chunks.append(b'\0' * _padding(len(section)))
+    return b''.join(chunks)
+
+
+def dumps(design):
+    if isinstance(design, (DFADesign, NFADesign)):
+        design = design.compile()
+
+    if isinstance(design, DFATable):
+        transitions = _array('I', design.transitions)
+        accept = Bitmap.pack(design.accept_flags)
+        return _pack(DFA_KIND, len(design.states), list(design.symbols), design.start_state,
+                     0, [transitions, accept])
+
+    if isinstance(design, BitNFADesign):
+        states = len(design.states)
+        symbols = list(design.moves)
+        blobs = []
+
+        def entry(mask):
+            blobs.append(mask.to_bytes((mask.bit_length() + 7) // 8, 'little'))
+            return len(blobs) - 1
+
+        entry(design.accept_mask)
+        closure_entries = [entry(design.closure_masks[i]) for i in range(states)]
+        move_entries = []
+        for character in symbols:
+            state_moves = design.moves[character]
+            move_entries.extend(entry(state_moves[i]) if i in state_moves else NO_ENTRY
+                                for i in range(states))
+        source_entries = [entry(design.sources[character]) for character in symbols]
+
+        offsets = [0]
+        for blob in blobs:
+            offsets.append(offsets[-1] + len(blob))
+        return _pack(NFA_KIND, states, symbols, 0, len(blobs),
+                     [_array('Q', offsets), b''.join(blobs), _array('I', closure_entries),
+                      _array('I', move_entries), _array('I', source_entries)])
+
+    raise TypeError(f"cannot serialize {type(design).__name__}")
+
+
+def loads(buffer):
+    if sys.byteorder != 'little':
+        raise FormatError('compiled automata can only be loaded on little-endian hosts')
+
+    view = memoryview(buffer)
+    if view.format != 'B':
+        view = view.cast('B')
+    if len(view) < HEADER.size:
+        raise FormatError('truncated header')
+    (magic, version, kind, states, symbol_count, start_state,
+     mask_count, symbol_bytes, mask_bytes) = HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise FormatError(f"bad magic {magic!r}")
+    if version != VERSION:
+        raise FormatError(f"unsupported version {version}")
+
+    position = HEADER.size
+
+    def section(size, format_character='B'):
+        nonlocal position
+        if position + size > len(view):
+            raise FormatError('truncated section')
+        chunk = view[position:position + size]
+        position += size + _padding(size)
+        return chunk.cast(format_character) if format_character != 'B' else chunk
+
+    symbol_offsets = section(4 * (symbol_count + 1), 'I')
+    symbol_blob = section(symbol_bytes)
+    symbols = [str(symbol_blob[symbol_offsets[i]:symbol_offsets[i + 1]], 'utf-8')
+               for i in range(symbol_count)]
+
+    if kind == DFA_KIND:
+        width = symbol_count + 1
+        transitions = section(4 * states * width, 'I')
+        accept_flags = Bitmap(section((states + 7) // 8), states)
+        return DFATable(range(states), {character: i for i, character in enumerate(symbols)},
+                        transitions, accept_flags, start_state)
+
+    if kind == NFA_KIND:
+        masks = MaskTable(section(8 * (mask_count + 1), 'Q'), section(mask_bytes))
+        closure_entries = section(4 * states, 'I')
+        move_entries = section(4 * symbol_count * states, 'I')
+        source_entries = section(4 * symbol_count, 'I')
+        moves = {character: LazyMasks(masks, move_entries[i * states:(i + 1) * states])
+                 for i, character in enumerate(symbols)}
+        sources = {character: masks.mask(source_entries[i]) for i, character in enumerate(symbols)}
+        return BitNFADesign(range(states), moves, sources,
+                            LazyMaskList(masks, closure_entries), masks.mask(0))
+
+    raise FormatError(f"unknown automaton kind {kind}")
+
+
+def dump(design, path):
+    with open(path, 'wb') as file:
+        file.write(dumps(design))
+
+
+# The returned automaton reads straight out of the mapping, which stays open
+# for as long as the automaton is alive and is shared between processes that
+# load the same file.
+def load(path):
+    with open(path, 'rb') as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    design = loads(mapped)
+    design.buffer = mapped
+    return design
+
+
+if __name__ == '__main__':
+    import itertools
+    import os
+    import tempfile
+
+    from the_simplest_computers.finite_automata import DFARulebook, FARule, NFARulebook, NFASimulation
+
+    rules = [FARule(1, 'a', 2), FARule(1, 'b', 1),
+             FARule(2, 'a', 2), FARule(2, 'b', 3),
+             FARule(3, 'a', 3), FARule(3, 'b', 3)]
+    dfa_design = DFADesign(1, [3], DFARulebook(rules))
+
+    simulation_rules = [FARule(1, 'a', 1), FARule(1, 'a', 2), FARule(1, None, 2),
+                        FARule(2, 'b', 3),
+                        FARule(3, 'b', 1), FARule(3, None, 2),
+                        FARule(3, 'é', 4)]
+    nfa_design = NFADesign(1, {3, 4}, NFARulebook(simulation_rules))
+
+    strings = [''.join(characters) for length in range(7)
+               for characters in itertools.product('abéc', repeat=length)]
+    for design in [dfa_design, NFASimulation(nfa_design).to_dfa_design(), nfa_design]:
+        data = dumps(design)
+        assert dumps(loads(data)) == data
+        loaded = loads(data)
+        compiled = design.compile()
+        assert [loaded.accepts(string) for string in strings] == \
+               [compiled.accepts(string) for string in strings]
+        print(type(loaded).__name__, len(data), 'bytes round trip ok')
+
+    with tempfile.NamedTemporaryFile(delete=False) as file:
+        pass
+    try:
+        dump(nfa_design, file.name)
+        loaded = load(file.name)
+        print(loaded, loaded.accepts('aab'), loaded.accepts('abé'), loaded.accepts('ba'))
+        # state labels are not stored, so states come back as their numbers
+        nfa = loaded.to_nfa()
+        nfa.read_string('ab')
+        print(nfa.current_states, nfa.accepting())
+    finally:
+        os.unlink(file.name)
+
+    try:
+        loads(b'nope' + bytes(HEADER.size))
+    except FormatError as error:
+        print(error)
@@ -0,0 +1,211 @@
+import codecs
+import mmap
+from abc import ABC, abstractmethod
+
+from the_simplest_computers.alphabet import PartitionedDesign
+from the_simplest_computers.finite_automata import BitNFADesign, DFADesign, DFATable, NFADesign
+
+
+# Feeds an automaton one chunk at a time. str chunks are read character by
+# character; bytes-like chunks (bytes, bytearray, memoryview, mmap) are read
+# through a memoryview without copying, each byte standing for the character
+# with the same code point, unless an encoding is given, in which case they
+# are decoded incrementally and multi-byte characters may span chunks. With
+# an AlphabetPartition the automaton reads alphabet classes, and each
+# character is looked up in it first.
+class StreamMatcher(ABC):
+    def __init__(self, state, encoding=None, partition=None):
+        self.start_state = state
+        self.state = state
+        self.decoder = codecs.getincrementaldecoder(encoding)() if encoding else None
+        self.partition = partition
+
+    def symbol(self, character):
+        return character if self.partition is None else self.partition.class_of(character)
+
+    def symbols(self, text):
+        return text if self.partition is None else self.partition.classify(text)
+
+    def __repr__(self):
+        return f"{type(self).__name__} state={self.state} accepting={self.accepting()}"
+
+    def feed(self, chunk):
+        if isinstance(chunk, str):
+            self.state = self.run_text(self.state, chunk)
+        elif self.decoder is not None:
+            self.state = self.run_text(self.state, self.decoder.decode(chunk))
+        else:
+            view = memoryview(chunk)
+            if view.format != 'B' or view.ndim != 1:
+                view = view.cast('B')
+            self.state = self.run_bytes(self.state, view)
+        return self
+
+    def accepting(self):
+        if self.decoder is not None and self.decoder.getstate()[0]:
+            return False
+        return self.state_accepting(self.state)
+
+    def snapshot(self):
+        return self.state, self.decoder.getstate() if self.decoder is not None else None
+
+    def restore(self, snapshot):
+        self.state, decoder_state = snapshot
+        if self.decoder is not None:
+            self.decoder.setstate(decoder_state)
+        return self
+
+    def reset(self):
+        self.state = self.start_state
+        if self.decoder is not None:
+            self.decoder.reset()
+        return self
+
+    @abstractmethod
+    def run_text(self, state, text):
+        pass
+
+    @abstractmethod
+    def run_bytes(self, state, view):
+        pass
+
+    @abstractmethod
+    def state_accepting(self, state):
+        pass
+
+
+class DFAStreamMatcher(StreamMatcher):
+    def __init__(self, table, encoding=None, partition=None):
+        super().__init__(table.start_state, encoding, partition)
+        self.table = table
+        other = table.width - 1
+        self.byte_symbols = [table.symbols.get(self.symbol(chr(byte)), other)
+                             for byte in range(256)]
+
+    def run_text(self, state, text):
+        return self.table.run(state, self.symbols(text))
+
+    def run_bytes(self, state, view):
+        byte_symbols = self.byte_symbols
+        transitions = self.table.transitions
+        width = self.table.width
+        dead_state = self.table.dead_state
+        for byte in view:
+            state = transitions[state * width + byte_symbols[byte]]
+            if state == dead_state:
+                break
+        return state
+
+    def state_accepting(self, state):
+        return self.table.accept_flags[state]
+
+
+class NFAStreamMatcher(StreamMatcher):
+    def __init__(self, design, encoding=None, partition=None):
+        super().__init__(design.start_mask, encoding, partition)
+        self.design = design
+        self.byte_moves = [(design.moves.get(symbol), design.sources.get(symbol, 0))
+                           for symbol in map(self.symbol, map(chr, range(256)))]
+
+    def run_text(self, state, text):
+        return self.design.run(state, self.symbols(text))
+
+    def run_bytes(self, mask, view):
+        byte_moves = self.byte_moves
+        for byte in view:
+            state_moves, sources = byte_moves[byte]
+            mask &= sources
+            next_mask = 0
+            while mask:
+                low = mask & -mask
+                next_mask |= state_moves[low.bit_length() - 1]
+                mask ^= low
+            if not next_mask:
+                return 0
+            mask = next_mask
+        return mask
+
+    def state_accepting(self, mask):
+        return bool(mask & self.design.accept_mask)
+
+
+def stream_matcher(design, encoding=None):
+    if isinstance(design, (DFADesign, NFADesign)):
+        design = design.compile()
+    partition = None
+    if isinstance(design, PartitionedDesign):
+        partition, design = design.partition, design.compile().design
+
+    if isinstance(design, DFATable):
+        return DFAStreamMatcher(design, encoding, partition)
+    elif isinstance(design, BitNFADesign):
+        return NFAStreamMatcher(design, encoding, partition)
+    raise TypeError(f"cannot stream {type(design).__name__}")
+
+
+def scan_file(design, path, chunk_size=1 << 20, encoding=None):
+    matcher = stream_matcher(design, encoding)
+    with open(path, 'rb') as file:
+        try:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files cannot be mapped
+            return matcher
+        with mapped, memoryview(mapped) as view:
+            for offset in range(0, len(view), chunk_size):
+                with view[offset:offset + chunk_size] as chunk:
+                    matcher.feed(chunk)
+    return matcher
+
+
+if __name__ == '__main__':
+    import os
+    import tempfile
+
+    from the_simplest_computers.finite_automata import DFARulebook, FARule, NFARulebook
+
+    rules = [FARule(1, 'a', 2), FARule(1, 'b', 1),
+             FARule(2, 'a', 2), FARule(2, 'b', 3),
+             FARule(3, 'a', 3), FARule(3, 'b', 3)]
+    dfa_design = DFADesign(1, [3], DFARulebook(rules))
+
+    matcher = stream_matcher(dfa_design)
+    matcher.feed('bba')
+    print(matcher, matcher.accepting())
+    saved = matcher.snapshot()
+    matcher.feed(b'b')
+    print(matcher.accepting())
+    matcher.restore(saved).feed(memoryview(b'aaa'))
+    print(matcher.accepting())
+
+    nfa_rules = [FARule(1, 'a', 1), FARule(1, 'b', 1), FARule(1, 'b', 2),
+                 FARule(2, 'a', 3), FARule(2, 'b', 3),
+                 FARule(3, 'a', 4), FARule(3, 'b', 4)]
+    nfa_design = NFADesign(1, {4}, NFARulebook(nfa_rules))
+    matcher = stream_matcher(nfa_design)
+    for chunk in ['bb', b'a', bytearray(b'b')]:
+        matcher.feed(chunk)
+    print(matcher, matcher.accepting(), nfa_design.accepts('bbab'))
+
+    # the base class only drives a subclass's hooks
+    try:
+        StreamMatcher(1)
+    except TypeError as error:
+        print(error)
+
+    # a multi-byte character split across chunks
+    unicode_design = DFADesign(1, [2], DFARulebook([FARule(1, 'é', 2)]))
+    matcher = stream_matcher(unicode_design, encoding='utf-8')
+    encoded = 'é'.encode('utf-8')
+    matcher.feed(encoded[:1])
+    print(matcher.accepting(), end=' ')
+    matcher.feed(encoded[1:])
+    print(matcher.accepting())
+
+    with tempfile.NamedTemporaryFile('wb', delete=False) as file:
+        file.write(b'ab' * 100000 + b'bbab')
+    try:
+        print(scan_file(nfa_design, file.name, chunk_size=4096).accepting(),
+              scan_file(dfa_design, file.name, chunk_size=4096).accepting())
+    finally:
+        os.unlink(file.name)